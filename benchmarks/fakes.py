@@ -0,0 +1,202 @@
+"""Offline stand-ins for Telegram and Delta Chat used by the benchmarks."""
+
+import asyncio
+import io
+import logging
+import os
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from typing import Dict, List, Optional
+
+from PIL import Image
+from telethon.tl import types
+
+
+def make_image(width: int = 1280, height: int = 720) -> bytes:
+    """Create a JPEG image with some detail so it doesn't compress to nothing."""
+    img = Image.effect_noise((width, height), 64).convert("RGB")
+    output = io.BytesIO()
+    img.save(output, format="JPEG", quality=90)
+    return output.getvalue()
+
+
+class FakeBot:
+    """The parts of simplebot's DeltaBot used by the plugin."""
+
+    def __init__(self, directory: str, config: Dict[str, str]) -> None:
+        self.config: Dict[str, Optional[str]] = dict(config)
+        self.logger = logging.getLogger("benchmark")
+        self.account = SimpleNamespace(db_path=os.path.join(directory, "bot.db"))
+        self.commands = SimpleNamespace(register=lambda **kwargs: None)
+        self.self_contact = None
+
+    def get(
+        self, key: str, default: Optional[str] = None, scope: Optional[str] = None
+    ) -> Optional[str]:
+        return self.config.get(f"{scope}/{key}" if scope else key, default)
+
+    def set(self, key: str, value: Optional[str], scope: Optional[str] = None) -> None:
+        self.config[f"{scope}/{key}" if scope else key] = value
+
+    def get_chat(self, chat_id: int) -> int:
+        return chat_id
+
+
+class RecordingReplies:
+    """Replacement of simplebot's Replies that records the sent messages."""
+
+    sent: List[dict] = []
+
+    def __init__(self, bot: FakeBot, logger) -> None:  # noqa
+        self._queue: List[dict] = []
+
+    def add(self, **kwargs) -> None:
+        self._queue.append(kwargs)
+
+    def send_reply_messages(self) -> list:
+        RecordingReplies.sent.extend(self._queue)
+        msgs = [SimpleNamespace(filename=args.get("filename")) for args in self._queue]
+        self._queue.clear()
+        return msgs
+
+
+class FakeMessage(SimpleNamespace):
+    """A channel post with the attributes the plugin reads, ``attrs`` override them."""
+
+    def __init__(
+        self, client: "FakeClient", channel: SimpleNamespace, msg_id: int, **attrs
+    ) -> None:
+        super().__init__(
+            **{
+                "id": msg_id,
+                "text": "",
+                "date": datetime(2022, 1, 1) + timedelta(minutes=msg_id),
+                "chat": channel,
+                "peer_id": types.PeerChannel(channel.id),
+                "grouped_id": None,
+                "fwd_from": None,
+                "sticker": None,
+                "document": None,
+                "media": None,
+                "photo": None,
+                "file": None,
+                "web_preview": None,
+                **attrs,
+            }
+        )
+        self._client = client
+
+    async def get_chat(self) -> SimpleNamespace:
+        return self.chat
+
+    async def download_media(self, directory: str) -> str:
+        await asyncio.sleep(self._client.latency)
+        path = os.path.join(directory, f"photo_{self.id}.jpg")
+        with open(path, "wb") as file:
+            file.write(
+                self._client.image[: self.file.size].ljust(self.file.size, b"\0")
+            )
+        self._client.downloaded += self.file.size
+        return path
+
+
+class FakeClient:
+    """A TelegramClient serving synthetic channels from memory.
+
+    :param latency: seconds every request takes.
+    """
+
+    def __init__(self, latency: float = 0.0) -> None:
+        self.latency = latency
+        self.channels: Dict[int, SimpleNamespace] = {}
+        self.messages: Dict[int, List[FakeMessage]] = {}
+        self.image = make_image()
+        self.downloaded = 0
+        self.requests = 0
+        self.session = SimpleNamespace(add_channel=lambda *args: None)
+
+    def add_channel(self, chan_id: int, title: str) -> SimpleNamespace:
+        channel = self.channels[chan_id] = SimpleNamespace(
+            id=chan_id,
+            title=title,
+            username=f"channel{chan_id}",
+            access_hash=chan_id * 7,
+            broadcast=True,
+        )
+        self.messages[chan_id] = []
+        return channel
+
+    def post(
+        self, chan_id: int, text: str, photo_size: int = 0, **attrs
+    ) -> FakeMessage:
+        """Add a post to a channel, with a photo of ``photo_size`` bytes if given."""
+        msgs = self.messages[chan_id]
+        msg_id = len(msgs) + 1
+        if photo_size:
+            attrs["photo"] = SimpleNamespace(id=chan_id * 1000000 + msg_id)
+            attrs["file"] = SimpleNamespace(size=photo_size)
+        msg = FakeMessage(self, self.channels[chan_id], msg_id, text=text, **attrs)
+        msgs.append(msg)
+        return msg
+
+    def is_connected(self) -> bool:
+        return True
+
+    async def _request(self) -> None:
+        self.requests += 1
+        await asyncio.sleep(self.latency)
+
+    async def get_messages(
+        self, peer, min_id: int = 0, limit: Optional[int] = None, reverse: bool = False
+    ) -> List[FakeMessage]:
+        await self._request()
+        msgs = [msg for msg in self.messages[peer.channel_id] if msg.id > min_id]
+        if not reverse:
+            msgs.reverse()
+        return msgs[:limit] if limit else msgs
+
+    async def send_read_acknowledge(self, peer, messages) -> None:  # noqa
+        await self._request()
+
+    async def get_entity(self, peer) -> SimpleNamespace:
+        await self._request()
+        return self.channels[peer.channel_id]
+
+    async def download_media(self, media, file) -> bytes:  # noqa
+        await self._request()
+        self.downloaded += len(self.image)
+        return self.image
+
+
+def make_page(paragraphs: int, photos: int):
+    """Create an Instant View page with text, links and photos."""
+    blocks: list = [types.PageBlockTitle(types.TextBold(types.TextPlain("Title")))]
+    for index in range(paragraphs):
+        blocks.append(
+            types.PageBlockParagraph(
+                types.TextConcat(
+                    [
+                        types.TextPlain(f"Paragraph {index} " + "lorem ipsum " * 20),
+                        types.TextUrl(
+                            types.TextItalic(types.TextPlain("link")),
+                            "https://example.com",
+                            0,
+                        ),
+                    ]
+                )
+            )
+        )
+        if index < photos:
+            blocks.append(
+                types.PageBlockPhoto(
+                    photo_id=index,
+                    caption=types.PageCaption(
+                        types.TextPlain(f"Photo {index}"), types.TextEmpty()
+                    ),
+                )
+            )
+    return SimpleNamespace(
+        blocks=blocks,
+        photos=[SimpleNamespace(id=index) for index in range(photos)],
+        documents=[],
+    )
@@ -0,0 +1,272 @@
+"""Offline benchmarks of the bridge's hot paths.
+
+Telegram and Delta Chat are replaced by in-memory fakes, so no network or
+accounts are needed. Run from the repository root with the plugin installed::
+
+    python benchmarks/run.py                 # all scenarios
+    python benchmarks/run.py poll --channels 100 --subscribers 50
+    python benchmarks/run.py --json results.json
+
+Scenarios:
+
+- poll: many channels with a few new posts each, fetched with ``check_channels``
+  and then delivered from the outbox.
+- catchup: a few channels with a large gap of missed posts.
+- render: Instant View pages with many photos rendered with ``page2html``.
+- filters: posts matched against the keyword filters of many subscribers.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import string
+import sys
+import time
+import tracemalloc
+from tempfile import TemporaryDirectory
+from types import SimpleNamespace
+from typing import Callable, Dict, List
+
+from fakes import FakeBot, FakeClient, RecordingReplies, make_page
+
+import simplebot_tgchan as plugin
+from simplebot_tgchan import outbox, util
+from simplebot_tgchan.filters import Matcher
+from simplebot_tgchan.instantview import RenderContext, page2html
+from simplebot_tgchan.orm import Channel, Outbox, Subscription, init, session_scope
+from simplebot_tgchan.ratelimit import RateLimiter
+
+
+def percentiles(values: List[float]) -> Dict[str, float]:
+    values = sorted(values) or [0.0]
+    return {
+        f"p{pct}": round(values[min(len(values) * pct // 100, len(values) - 1)], 4)
+        for pct in (50, 90, 99)
+    }
+
+
+def setup(
+    directory: str, client: FakeClient, channels: int, subscribers: int
+) -> FakeBot:
+    """Start the plugin with the given fake client, without connecting anywhere.
+
+    ``channels`` channels are created, with ``subscribers`` chats subscribed to each.
+    """
+    bot = FakeBot(directory, {"simplebot_tgchan/session": "fake"})
+    plugin.deltabot_init(bot)
+    for key, value in (
+        ("rate_limit", "1000000"),
+        ("page_cache_size", str(1024**3)),
+        ("media_cache_size", str(1024**3)),
+    ):
+        bot.set(key, value, scope="simplebot_tgchan")
+    path = os.path.join(directory, "plugin")
+    os.makedirs(path)
+    init(f"sqlite:///{os.path.join(path, 'sqlite.db')}")
+    with session_scope() as session:
+        for chan_id in range(1, channels + 1):
+            channel = client.add_channel(chan_id, f"Channel {chan_id}")
+            session.add(
+                Channel(
+                    id=chan_id,
+                    title=channel.title,
+                    last_msg=0,
+                    access_hash=channel.access_hash,
+                )
+            )
+            for chat_id in range(1, subscribers + 1):
+                session.add(Subscription(chat_id=chat_id, chan_id=chan_id, filter=""))
+    plugin.init_plugin(bot, path)
+    outbox.start_delivery(bot, os.path.join(path, "outbox"), workers=0)
+    outbox.Replies = RecordingReplies
+    RecordingReplies.sent.clear()
+    util.add_client(0, client, RateLimiter(1000000))  # type: ignore
+    return bot
+
+
+async def check(bot: FakeBot, channels: List[int]) -> List[float]:
+    """Check the given channels, returns the time it took to check each."""
+    latencies = []
+    check_channel = plugin.check_channel
+
+    async def timed(*args, **kwargs) -> None:
+        start = time.perf_counter()
+        try:
+            await check_channel(*args, **kwargs)
+        finally:
+            latencies.append(time.perf_counter() - start)
+
+    plugin.check_channel = timed
+    try:
+        await plugin.check_channels(bot, channels)
+    finally:
+        plugin.check_channel = check_channel
+    return latencies
+
+
+def deliver(bot: FakeBot) -> int:
+    """Send everything in the outbox, returns the number of sent messages."""
+    sent = 0
+    while True:
+        count = outbox.deliver(bot)
+        if not count:
+            return sent
+        sent += count
+
+
+def measure(bot: FakeBot, client: FakeClient, channels: List[int]) -> dict:
+    tracemalloc.start()
+    start = time.perf_counter()
+    latencies = asyncio.run(check(bot, channels))
+    fetch_time = time.perf_counter() - start
+    with session_scope() as session:
+        queued = session.query(Outbox).count()
+    start = time.perf_counter()
+    sent = deliver(bot)
+    delivery_time = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    fetched = sum(len(client.messages[chan_id]) for chan_id in channels)
+    return {
+        "channels": len(channels),
+        "posts_fetched": fetched,
+        "fetch_seconds": round(fetch_time, 3),
+        "posts_per_second": round(fetched / fetch_time, 1),
+        "channel_check_seconds": percentiles(latencies),
+        "telegram_requests": client.requests,
+        "mb_downloaded": round(client.downloaded / 1024**2, 2),
+        "messages_queued": queued,
+        "messages_sent": sent,
+        "delivery_seconds": round(delivery_time, 3),
+        "deliveries_per_second": round(sent / delivery_time, 1) if sent else 0,
+        "peak_memory_mb": round(peak / 1024**2, 2),
+    }
+
+
+def bench_poll(args) -> dict:
+    client = FakeClient(args.latency)
+    with TemporaryDirectory() as directory:
+        bot = setup(directory, client, args.channels, args.subscribers)
+        for chan_id in client.channels:
+            for index in range(args.posts):
+                photo = args.photo_size if index % 2 else 0
+                client.post(chan_id, f"Post {index} of {chan_id}", photo_size=photo)
+        return measure(bot, client, list(client.channels))
+
+
+def bench_catchup(args) -> dict:
+    client = FakeClient(args.latency)
+    with TemporaryDirectory() as directory:
+        bot = setup(directory, client, args.gap_channels, args.subscribers)
+        for chan_id in client.channels:
+            for index in range(args.gap):
+                client.post(chan_id, f"Post {index} of {chan_id}")
+        return measure(bot, client, list(client.channels))
+
+
+def bench_render(args) -> dict:
+    client = FakeClient(args.latency)
+    page = make_page(args.paragraphs, args.photos)
+    msg = SimpleNamespace(
+        media=None, web_preview=SimpleNamespace(photo=None, cached_page=page)
+    )
+    logger = FakeBot(".", {}).logger
+    latencies = []
+
+    async def render() -> int:
+        size = 0
+        for _ in range(args.pages):
+            start = time.perf_counter()
+            html = await page2html(
+                page.blocks, RenderContext(client=client, msg=msg, logger=logger)
+            )
+            latencies.append(time.perf_counter() - start)
+            size = len(html)
+        return size
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    size = asyncio.run(render())
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {
+        "pages": args.pages,
+        "photos_per_page": args.photos,
+        "pages_per_second": round(args.pages / elapsed, 2),
+        "render_seconds": percentiles(latencies),
+        "html_kb": round(size / 1024, 1),
+        "peak_memory_mb": round(peak / 1024**2, 2),
+    }
+
+
+def bench_filters(args) -> dict:
+    rnd = random.Random(0)
+
+    def word() -> str:
+        return "".join(rnd.choices(string.ascii_lowercase, k=rnd.randint(4, 9)))
+
+    words = [word() for _ in range(500)]
+    posts = [" ".join(rnd.choices(words, k=300)) for _ in range(20)]
+    modes = ("", "i:", "w:", "iw:")
+    matcher = Matcher(
+        (chat_id, rnd.choice(modes) + word()) for chat_id in range(args.filters)
+    )
+    latencies = []
+    for _ in range(args.matches // len(posts)):
+        for post in posts:
+            start = time.perf_counter()
+            matcher.match(post)
+            latencies.append(time.perf_counter() - start)
+    return {
+        "filters": args.filters,
+        "matches_per_second": round(len(latencies) / sum(latencies), 1),
+        "match_seconds": percentiles(latencies),
+    }
+
+
+SCENARIOS: Dict[str, Callable[[argparse.Namespace], dict]] = {
+    "poll": bench_poll,
+    "catchup": bench_catchup,
+    "render": bench_render,
+    "filters": bench_filters,
+}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n", maxsplit=1)[0])
+    parser.add_argument("scenarios", nargs="*", help=", ".join(SCENARIOS))
+    parser.add_argument("--channels", type=int, default=1000)
+    parser.add_argument("--subscribers", type=int, default=5)
+    parser.add_argument("--posts", type=int, default=4, help="new posts per channel")
+    parser.add_argument("--photo-size", type=int, default=200 * 1024)
+    parser.add_argument("--gap-channels", type=int, default=10)
+    parser.add_argument("--gap", type=int, default=1000, help="missed posts")
+    parser.add_argument("--pages", type=int, default=20)
+    parser.add_argument("--paragraphs", type=int, default=50)
+    parser.add_argument("--photos", type=int, default=20, help="photos per page")
+    parser.add_argument("--filters", type=int, default=1000, help="keyword filters")
+    parser.add_argument("--matches", type=int, default=1000)
+    parser.add_argument(
+        "--latency", type=float, default=0.01, help="seconds per Telegram request"
+    )
+    parser.add_argument("--json", help="save the results to the given file")
+    args = parser.parse_args()
+    for name in args.scenarios:
+        if name not in SCENARIOS:
+            parser.error(f"unknown scenario: {name}")
+
+    results = {}
+    for name in args.scenarios or SCENARIOS:
+        print(f"Running {name}...", file=sys.stderr)
+        results[name] = SCENARIOS[name](args)
+        print(json.dumps({name: results[name]}, indent=2))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,24 +1,88 @@
 """hooks, filters and commands definitions."""
 
 import asyncio
+import mimetypes
 import os
+import re
 import time
-from tempfile import TemporaryDirectory
-from threading import Thread
+from functools import partial
+from typing import Dict, List, Optional, Tuple
 
 import simplebot
 from deltachat import Chat, Contact, Message
 from simplebot import DeltaBot
 from simplebot.bot import Replies
-from telethon import TelegramClient
-from telethon.tl.functions.channels import JoinChannelRequest
-from telethon.tl.functions.messages import ImportChatInviteRequest
-from telethon.tl.types import PeerChannel
-
-from .instantview import page2html
-from .orm import Channel, Subscription, init, session_scope
+from telethon import TelegramClient, events
+from telethon.errors import FloodWaitError, RPCError
+
+from .cache import MediaCache, PageCache
+from .channels import (
+    get_input_channel,
+    get_least_loaded_session,
+    join_channel,
+    leave_channels,
+)
+from .dedup import DedupIndex, get_post_keys
+from .digest import (
+    add_post,
+    discard_posts,
+    flush_digests,
+    parse_duration,
+    post2html,
+    save_images,
+)
+from .filters import Matcher, parse_filter
+from .instantview import (
+    ImageOptions,
+    RenderContext,
+    album2html,
+    is_supported_format,
+    write_page,
+)
+from .metrics import (
+    dump,
+    get_report,
+    get_slowest_channels,
+    inc,
+    observe,
+    observe_channel,
+)
+from .orm import Channel, Outbox, Subscription, init, session_scope
+from .outbox import (
+    discard_chat,
+    enqueue,
+    make_spool_dir,
+    notify_workers,
+    remove_spools,
+    start_delivery,
+)
+from .routing import RoutingTable
+from .scheduler import Delays, Scheduler, next_interval, retry_delay, update_activity
 from .subcommands import login
-from .util import get_client, getdefault, set_config, sync
+from .util import (
+    get_connected_client,
+    get_limiter,
+    get_sessions,
+    getdefault,
+    save_update_state,
+    set_config,
+    set_session,
+    submit,
+    sync,
+)
+
+_BATCH_SIZE = 20
+# how long commands wait for Telegram's flood waits before giving up
+_COMMAND_MAX_WAIT = 30
+# how many times a post that fails to be processed is tried before skipping it
+_MAX_POST_ATTEMPTS = 3
+_locks: Dict[int, asyncio.Lock] = {}
+# failed attempts of the posts being retried, by (channel ID, message ID)
+_post_attempts: Dict[Tuple[int, int], int] = {}
+_page_cache: Optional[PageCache] = None
+_media_cache: Optional[MediaCache] = None
+_dedup: Optional[DedupIndex] = None
+_routes = RoutingTable()
 
 
 @simplebot.hookimpl
@@ -31,20 +95,92 @@ def deltabot_init(bot: DeltaBot) -> None:
     getdefault(bot, "api_id", "")
     getdefault(bot, "api_hash", "")
     getdefault(bot, "delay", str(60 * 5))
+    getdefault(bot, "min_delay", str(60))
+    getdefault(bot, "max_delay", str(60 * 60 * 6))
     getdefault(bot, "max_size", str(1024**2 * 5))
+    getdefault(bot, "page_cache_size", str(1024**2 * 50))
+    getdefault(bot, "media_cache_size", str(1024**2 * 100))
+    getdefault(bot, "img_max_width", "800")
+    getdefault(bot, "img_format", "JPEG")
+    getdefault(bot, "img_quality", "75")
+    getdefault(bot, "img_page_budget", str(1024**2 * 2))
+    getdefault(bot, "max_backlog", "0")
+    getdefault(bot, "summarize_overflow", "0")
+    getdefault(bot, "live", "1")
+    getdefault(bot, "concurrency", "5")
+    getdefault(bot, "rate_limit", "3")
+    getdefault(bot, "delivery_workers", "1")
+    getdefault(bot, "dedup_ttl", str(60 * 60 * 24))
+    getdefault(bot, "metrics_file", "")
+    getdefault(bot, "max_failures", "5")
+    getdefault(bot, "probe_delay", str(60 * 60 * 24))
     allow_sub = getdefault(bot, "allow_subscriptions", "1") == "1"
     bot.commands.register(func=sub, admin=not allow_sub)
     bot.commands.register(func=unsub, admin=not allow_sub)
+    bot.commands.register(func=tgstats, admin=True)
 
 
 @simplebot.hookimpl
 def deltabot_start(bot: DeltaBot) -> None:
     path = os.path.join(os.path.dirname(bot.account.db_path), __name__)
+    init_plugin(bot, path)
+    start_delivery(
+        bot, os.path.join(path, "outbox"), int(getdefault(bot, "delivery_workers"))
+    )
+    submit(listen_to_telegram(bot)).add_done_callback(partial(_on_listener_done, bot))
+
+
+def init_plugin(bot: DeltaBot, path: str) -> None:
+    """Open the database and caches kept in ``path`` and load the subscriptions."""
     if not os.path.exists(path):
         os.makedirs(path)
-    path = os.path.join(path, "sqlite.db")
-    init(f"sqlite:///{path}")
-    Thread(target=listen_to_telegram, args=(bot,), daemon=True).start()
+    global _page_cache, _media_cache, _dedup  # noqa
+    _locks.clear()
+    _post_attempts.clear()
+    _page_cache = PageCache(
+        os.path.join(path, "pages"), int(getdefault(bot, "page_cache_size"))
+    )
+    _media_cache = MediaCache(
+        os.path.join(path, "media"), int(getdefault(bot, "media_cache_size"))
+    )
+    _dedup = DedupIndex(int(getdefault(bot, "dedup_ttl")))
+    init(f"sqlite:///{os.path.join(path, 'sqlite.db')}")
+    with session_scope() as session:
+        subscriptions = get_subscriptions(session)
+    _check_filters(bot, subscriptions)
+    _check_img_format(bot)
+    _routes.load(subscriptions)
+
+
+def _check_filters(bot: DeltaBot, subscriptions: Dict[int, list]) -> None:
+    """Warn about stored filters that are invalid regular expressions.
+
+    Filters stored before the ``re:`` mode existed may have become invalid
+    regular expressions, those chats don't get any post from the channel.
+    """
+    for chan_id, subs in subscriptions.items():
+        for chat_id, filter_, _ in subs:
+            try:
+                parse_filter(filter_)
+            except re.error as ex:
+                bot.logger.warning(
+                    f"Chat {chat_id} has an invalid filter for channel {chan_id},"
+                    f" it won't get any post: {filter_!r} ({ex})"
+                )
+
+
+def _check_img_format(bot: DeltaBot) -> None:
+    """Reset the ``img_format`` setting to the default if Pillow can't save it."""
+    img_format = getdefault(bot, "img_format")
+    if not is_supported_format(img_format):
+        bot.logger.warning(f"Unsupported img_format {img_format!r}, using JPEG instead")
+        set_config(bot, "img_format", "JPEG")
+
+
+def _on_listener_done(bot: DeltaBot, future) -> None:
+    """Log why the Telegram listener stopped, it is never expected to."""
+    if not future.cancelled() and future.exception():
+        bot.logger.error("Telegram listener stopped", exc_info=future.exception())
 
 
 @simplebot.hookimpl
@@ -52,25 +188,35 @@ def deltabot_member_removed(bot: DeltaBot, chat: Chat, contact: Contact) -> None
     if bot.self_contact != contact and len(chat.get_contacts()) > 1:
         return
 
-    empty_channels = []
+    channels, empty_channels = [], []
     with session_scope() as session:
+        unused_spools = discard_chat(session, chat.id)
+        unused_spools += discard_posts(session, chat.id)
         for subs in session.query(Subscription).filter_by(chat_id=chat.id):
             channel = subs.channel
+            channels.append(channel.id)
             session.delete(subs)
             if not channel.subscriptions:
                 bot.logger.debug(
                     f"Removing channel without subscriptions: {channel.id}"
                 )
-                empty_channels.append(channel.id)
+                empty_channels.append((channel.id, channel.session))
                 session.delete(channel)
+    remove_spools(unused_spools)
+    for chan_id in channels:
+        _routes.remove(chan_id, chat.id)
 
     if empty_channels:
-        leave_channels(bot, *empty_channels)
+        submit(leave_channels(bot, *empty_channels))
 
 
 def sub(bot: DeltaBot, payload: str, message: Message, replies: Replies) -> None:
-    """Subscribe chat to the given Telegram channel."""
-    if not getdefault(bot, "session"):
+    """Subscribe chat to the given Telegram channel.
+
+    Add --digest and an interval, like 1h or 1d, to get the channel's posts
+    together in a single message once per interval.
+    """
+    if not get_sessions(bot):
         replies.add(text="❌ You must log in first", quote=message)
     elif not payload:
         replies.add(text="❌ You must provide a channel link or name", quote=message)
@@ -84,42 +230,84 @@ def sub(bot: DeltaBot, payload: str, message: Message, replies: Replies) -> None
 
 @sync
 async def _sub(bot: DeltaBot, payload: str, message: Message, replies: Replies) -> None:
+    digest = re.search(r"(^|\s)--digest\s+(\S+)", payload)
+    if digest:
+        payload = payload[: digest.start()] + payload[digest.end() :]
     args = payload.split(maxsplit=1)
+    if not args:
+        replies.add(text="❌ You must provide a channel link or name", quote=message)
+        return
     chan = args[0].rsplit("/", maxsplit=1)[-1]
-    if "/joinchat/" in args[0]:
-        request = ImportChatInviteRequest
-    elif chan.startswith("+"):
-        request = ImportChatInviteRequest
-        chan = chan[1:]
+    invite = "/joinchat/" in args[0] or chan.startswith("+")
+    if invite:
+        chan = chan.lstrip("+")
     else:
-        request = JoinChannelRequest
         chan = chan.lstrip("@").replace(" ", "_")
     filter_ = args[1] if len(args) == 2 else ""
+    if filter_.startswith("re:") and not bot.is_admin(message.get_sender_contact()):
+        replies.add(
+            text="❌ Only bot administrators can use regular expression filters",
+            quote=message,
+        )
+        return
 
     try:
-        client = get_client(bot)
-        await client.connect()
-        channel = (await client(request(chan))).chats[0]
+        parse_filter(filter_)
+        interval = parse_duration(digest.group(2)) if digest else None
+        index = get_least_loaded_session(bot)
+        client = await get_connected_client(bot, index)
+        channel, owner = await join_channel(
+            client, chan, invite, max_wait=_COMMAND_MAX_WAIT
+        )
         assert channel.broadcast, "Invalid channel"
-        set_config(bot, "session", client.session.save())
+        set_session(bot, index, client.session.save())
+        msgs, unused_spools = [], []
+        if owner is None:  # don't hold the database while waiting for Telegram
+            msgs = await get_limiter(client).call(
+                "history",
+                client.get_messages,
+                channel,
+                limit=1,
+                max_wait=_COMMAND_MAX_WAIT,
+            )
         with session_scope() as session:
             if not session.query(Channel).filter_by(id=channel.id).first():
-                msgs = await client.get_messages(channel, limit=1)
-                msg_id = msgs[0].id if msgs else 0
                 session.add(
-                    Channel(id=channel.id, title=channel.title, last_msg=msg_id)
-                )
-            session.add(
-                Subscription(
-                    chat_id=message.chat.id, chan_id=channel.id, filter=filter_
+                    Channel(
+                        id=channel.id,
+                        title=channel.title,
+                        last_msg=msgs[0].id if msgs else 0,
+                        access_hash=channel.access_hash,
+                        session=index,
+                    )
                 )
+                client.session.add_channel(channel.id, channel.access_hash)
+            subs = (
+                session.query(Subscription)
+                .filter_by(chat_id=message.chat.id, chan_id=channel.id)
+                .first()
             )
+            if not subs:
+                subs = Subscription(chat_id=message.chat.id, chan_id=channel.id)
+                session.add(subs)
+            elif (
+                subs.digest and not interval
+            ):  # no more digests, drop the pending posts
+                unused_spools = discard_posts(session, message.chat.id, channel.id)
+            if subs.digest != interval:
+                subs.digest_at = time.time() + interval if interval else None
+            subs.filter, subs.digest = filter_, interval
+        remove_spools(unused_spools)
+        _routes.add(channel.id, message.chat.id, filter_, interval)
         replies.add(text=f"✔️ Subscribed to {channel.title!r}")
+    except FloodWaitError as ex:
+        replies.add(
+            text=f"❌ Telegram is limiting requests, retry later (in {ex.seconds} seconds)",
+            quote=message,
+        )
     except Exception as ex:
         bot.logger.exception(ex)
         replies.add(text=f"❌ Error: {ex}", quote=message)
-    finally:
-        await client.disconnect()
 
 
 def unsub(bot: DeltaBot, payload: str, message: Message, replies: Replies) -> None:
@@ -127,7 +315,7 @@ def unsub(bot: DeltaBot, payload: str, message: Message, replies: Replies) -> No
 
     If no channel is given, list all channels that can be unsubscribed in the current chat.
     """
-    empty_channels = []
+    unsubscribed, empty_channels, unused_spools = None, [], []
     with session_scope() as session:
         if payload:
             chan_id = int(payload.replace("n", "-"))
@@ -140,13 +328,15 @@ def unsub(bot: DeltaBot, payload: str, message: Message, replies: Replies) -> No
                 channel = subs.channel
                 title = channel.title
                 session.delete(subs)
+                unused_spools = discard_posts(session, message.chat.id, chan_id)
                 if not channel.subscriptions:
                     bot.logger.debug(
                         f"Removing channel without subscriptions: {channel.id}"
                     )
-                    empty_channels.append(channel.id)
+                    empty_channels.append((channel.id, channel.session))
                     session.delete(channel)
                 replies.add(text=f"✔️ Unsubscribed from {title!r}")
+                unsubscribed = chan_id
             else:
                 replies.add(
                     text="❌ Error: chat is not subscribed to that channel",
@@ -154,109 +344,656 @@ def unsub(bot: DeltaBot, payload: str, message: Message, replies: Replies) -> No
                 )
         else:
             text = ""
-            for subs in session.query(Subscription).filter_by(chat_id=message.chat.id):
-                chan = str(subs.chan_id).replace("-", "n")
-                text += f"{subs.channel.title}\n/unsub_{chan}\n\n"
+            query = (
+                session.query(Subscription.chan_id, Channel.title)
+                .join(Channel)
+                .filter(Subscription.chat_id == message.chat.id)
+            )
+            for chan_id, title in query:
+                chan = str(chan_id).replace("-", "n")
+                text += f"{title}\n/unsub_{chan}\n\n"
             if not text:
                 text = "❌ No subscriptions in this chat"
             replies.add(text=text)
+    remove_spools(unused_spools)
+    if unsubscribed is not None:
+        _routes.remove(unsubscribed, message.chat.id)
 
     if empty_channels:
-        leave_channels(bot, *empty_channels)
+        submit(leave_channels(bot, *empty_channels))
+
+
+def tgstats(bot: DeltaBot, replies: Replies) -> None:
+    """Show statistics about the bridge's activity since it started."""
+    text = get_report(get_gauges(bot))
+    slowest = get_slowest_channels()
+    if slowest:
+        with session_scope() as session:
+            titles = dict(
+                session.query(Channel.id, Channel.title).filter(
+                    Channel.id.in_([chan_id for chan_id, _ in slowest])
+                )
+            )
+        text += "\n\nSlowest channels:\n" + "\n".join(
+            f"{titles.get(chan_id, chan_id)}: {seconds:.3f}s"
+            for chan_id, seconds in slowest
+        )
+    replies.add(text=text)
+
+
+def get_gauges(bot: DeltaBot) -> Dict[str, float]:
+    """Get the current value of the metrics that aren't counted as they happen."""
+    max_failures = int(getdefault(bot, "max_failures"))
+    with session_scope() as session:
+        quarantined = session.query(Channel).filter(Channel.failures >= max_failures)
+        return {
+            "outbox_size": session.query(Outbox).count(),
+            "quarantined_channels": quarantined.count(),
+        }
 
 
-@sync
 async def listen_to_telegram(bot: DeltaBot) -> None:
-    if not getdefault(bot, "session"):
+    if not get_sessions(bot):
         bot.logger.warning("Telegram session not configured")
         return
 
+    clients = []
+    for index in range(len(get_sessions(bot))):
+        try:
+            clients.append(await get_connected_client(bot, index))
+        except Exception as ex:
+            bot.logger.exception(ex)
+    first_check = time.time()
+    if getdefault(bot, "live") == "1":
+        for client in clients:
+            client.add_event_handler(
+                partial(on_new_message, bot),
+                events.NewMessage(func=lambda e: e.is_channel and not e.grouped_id),
+            )
+            client.add_event_handler(
+                partial(on_new_album, bot), events.Album(func=lambda e: e.is_channel)
+            )
+        bot.logger.debug("Listening to Telegram updates")
+        if any(client.session.get_update_state(0) for client in clients):
+            # missed posts are fetched by catching up with the saved update state
+            first_check += int(getdefault(bot, "delay"))
+
+    scheduler = Scheduler()
     while True:
+        delay = 60.0
+        try:
+            delay = await _poll(bot, scheduler, clients, first_check)
+        except Exception as ex:
+            bot.logger.exception(ex)
+        await asyncio.sleep(min(max(delay, 1), 60))
+
+
+async def _poll(
+    bot: DeltaBot, scheduler: Scheduler, clients: list, first_check: float
+) -> float:
+    """Check the due channels and do the periodic chores.
+
+    Returns the seconds until the next channel is due.
+    """
+    due = max(first_check, time.time())
+    with session_scope() as session:
+        query = session.query(Channel.id, Channel.retry_at)
+        schedule = {chan_id: max(due, retry_at or 0) for chan_id, retry_at in query}
+    scheduler.sync(schedule)
+    channels = scheduler.pop_due(time.time())
+    if channels:
         bot.logger.debug("Checking Telegram")
         start = time.time()
         try:
-            await check_channels(bot)
+            await check_channels(bot, channels)
+        except Exception as ex:
+            bot.logger.exception(ex)
+        try:
+            _reschedule(bot, scheduler, channels)
         except Exception as ex:
             bot.logger.exception(ex)
+            # don't drop the channels from the schedule, check them again later
+            retry_at = time.time() + int(getdefault(bot, "delay"))
+            for chan_id in channels:
+                scheduler.schedule(chan_id, retry_at)
+        observe("sweep_seconds", time.time() - start)
         elapsed = int(time.time() - start)
-        delay = max(int(getdefault(bot, "delay")) - elapsed, 30)
         bot.logger.debug(
-            f"Done checking Telegram after {elapsed} seconds, sleeping for {delay} seconds..."
+            f"Done checking {len(channels)} channels after {elapsed} seconds"
         )
-        await asyncio.sleep(delay)
+    try:
+        if await flush_digests(_get_img_options(bot)):
+            notify_workers()
+    except Exception as ex:
+        bot.logger.exception(ex)
+    for client in clients:
+        try:
+            await save_update_state(client)
+        except Exception as ex:
+            bot.logger.exception(ex)
+    if getdefault(bot, "metrics_file"):
+        try:
+            dump(getdefault(bot, "metrics_file"), get_gauges(bot))
+        except Exception as ex:
+            bot.logger.exception(ex)
+    next_due = scheduler.next_due()
+    return 60 if next_due is None else next_due - time.time()
+
+
+def _reschedule(bot: DeltaBot, scheduler: Scheduler, channels: list) -> None:
+    default = int(getdefault(bot, "delay"))
+    min_delay = int(getdefault(bot, "min_delay"))
+    if getdefault(bot, "live") == "1":
+        # new posts are pushed in live mode, polling only fills the gaps
+        min_delay = max(min_delay, default)
+    delays = Delays(default, min_delay, int(getdefault(bot, "max_delay")))
+    now = time.time()
+    with session_scope() as session:
+        for chan in session.query(Channel).filter(Channel.id.in_(channels)):
+            if chan.retry_at:
+                scheduler.schedule(chan.id, chan.retry_at)
+                continue
+            interval = next_interval(chan.last_post, chan.post_interval, now, delays)
+            scheduler.schedule(chan.id, now + interval)
 
 
-async def check_channels(bot: DeltaBot) -> None:
-    try:
-        client = get_client(bot)
-        await client.connect()
+async def on_new_message(bot: DeltaBot, event) -> None:
+    await _on_new_post(bot, event.client, [event.message], event.get_chat)
+
+
+async def on_new_album(bot: DeltaBot, event) -> None:
+    await _on_new_post(bot, event.client, event.messages, event.get_chat)
+
+
+async def _on_new_post(
+    bot: DeltaBot, client: TelegramClient, messages: list, get_chat
+) -> None:
+    chan_id = messages[0].peer_id.channel_id
+    async with _get_lock(chan_id):
         with session_scope() as session:
-            bot.logger.debug("Channels to check: %s", session.query(Channel).count())
-            for chan in session.query(Channel):
-                try:
-                    await check_channel(bot, client, chan)
-                    await asyncio.sleep(0.5)
-                except Exception as ex:
-                    bot.logger.exception(ex)
-    finally:
-        await client.disconnect()
-
-
-async def check_channel(bot: DeltaBot, client: TelegramClient, dbchan: Channel) -> None:
-    channel = await client.get_entity(PeerChannel(dbchan.id))
-    dbchan.title = channel.title
-    messages = list(
-        reversed(await client.get_messages(channel, min_id=dbchan.last_msg, limit=20))
+            dbchan = session.query(Channel).filter_by(id=chan_id).first()
+            if not dbchan:
+                return
+            messages = [msg for msg in messages if msg.id > dbchan.last_msg]
+        if not messages:
+            return
+        channel = await get_limiter(client).call("channels", get_chat)
+        bot.logger.debug(f"Channel {channel.title!r} got a new post")
+        await process_messages(bot, client, channel, messages, _routes.get(chan_id))
+
+
+async def check_channels(bot: DeltaBot, channels: list) -> None:
+    bot.logger.debug("Channels to check: %s", len(channels))
+    with session_scope() as session:
+        sessions = dict(session.query(Channel.id, Channel.session))
+    shards: Dict[int, list] = {}
+    for chan_id in channels:
+        if chan_id in sessions:
+            shards.setdefault(sessions[chan_id], []).append(chan_id)
+    await asyncio.gather(
+        *(_check_shard(bot, index, chan_ids) for index, chan_ids in shards.items())
     )
-    bot.logger.debug(f"Channel {channel.title!r} has {len(messages)} new messages")
-    for message in messages:
+
+
+async def _check_shard(bot: DeltaBot, index: int, channels: list) -> None:
+    """Check the given channels, all owned by the session at ``index``."""
+    try:
+        client = await get_connected_client(bot, index)
+    except Exception as ex:
+        bot.logger.exception(ex)
+        return
+    pending = iter(channels)
+    workers = min(int(getdefault(bot, "concurrency")), len(channels))
+    await asyncio.gather(*(_check_worker(bot, client, pending) for _ in range(workers)))
+
+
+async def _check_worker(bot: DeltaBot, client: TelegramClient, pending) -> None:
+    """Check channels taken from the shared ``pending`` iterator until it is exhausted."""
+    for chan_id in pending:
+        start = time.monotonic()
         try:
-            await tg2dc(bot, client, message, dbchan)
+            await check_channel(bot, client, chan_id)
+        except RPCError as ex:
+            # Telegram refused the request, the channel may be gone or private
+            bot.logger.exception(ex)
+            _on_check_failure(bot, chan_id, ex)
         except Exception as ex:
             bot.logger.exception(ex)
-        dbchan.last_msg = message.id
-    await client.send_read_acknowledge(channel, messages)
+        else:
+            _on_check_success(bot, chan_id)
+        observe_channel(chan_id, time.monotonic() - start)
 
 
-async def tg2dc(bot: DeltaBot, client: TelegramClient, msg, dbchan: Channel) -> None:
-    if msg.text is None:
-        return
-    replies = Replies(bot, bot.logger)
-    args = dict(
-        text=msg.text,
-        sender=dbchan.title or "Unknown",
+def _on_check_failure(bot: DeltaBot, chan_id: int, error: RPCError) -> None:
+    """Back off checking a channel after a failure, quarantine it after too many.
+
+    Quarantined channels are only probed every ``probe_delay`` seconds.
+    """
+    max_failures = int(getdefault(bot, "max_failures"))
+    with session_scope() as session:
+        # increment in the database so concurrent updates aren't lost
+        query = session.query(Channel).filter_by(id=chan_id)
+        query.update(
+            {Channel.failures: Channel.failures + 1}, synchronize_session=False
+        )
+        dbchan = query.first()
+        if not dbchan:
+            return
+        failures, title = dbchan.failures, dbchan.title
+        if failures >= max_failures:
+            delay = int(getdefault(bot, "probe_delay"))
+        else:
+            delay = retry_delay(
+                failures,
+                int(getdefault(bot, "delay")),
+                int(getdefault(bot, "max_delay")),
+            )
+        dbchan.retry_at = time.time() + delay
+    bot.logger.warning(
+        f"Channel {title!r} failed {failures} times in a row, retrying in {delay} seconds"
+    )
+    if failures == max_failures:
+        notify_subscribers(
+            chan_id,
+            f"⚠️ Channel {title!r} can't be reached ({error.message}),"
+            " it will be checked from time to time and posts will resume if it recovers",
+        )
+
+
+def _on_check_success(bot: DeltaBot, chan_id: int) -> None:
+    """Reset the failures of a channel, notifying if it was quarantined."""
+    with session_scope() as session:
+        row = (
+            session.query(Channel.failures, Channel.title)
+            .filter(Channel.id == chan_id, Channel.failures > 0)
+            .first()
+        )
+        if not row:
+            return
+        failures, title = row
+        # only reset the failures that were read, a new failure wins
+        reset = (
+            session.query(Channel)
+            .filter(Channel.id == chan_id, Channel.failures == failures)
+            .update({Channel.failures: 0, Channel.retry_at: None})
+        )
+    if reset and failures >= int(getdefault(bot, "max_failures")):
+        notify_subscribers(chan_id, f"✔️ Channel {title!r} is reachable again")
+
+
+async def check_channel(bot: DeltaBot, client: TelegramClient, chan_id: int) -> None:
+    async with _get_lock(chan_id):
+        with session_scope() as session:
+            dbchan = session.query(Channel).filter_by(id=chan_id).first()
+            if not dbchan:
+                return
+            last_msg, title = dbchan.last_msg, dbchan.title
+            access_hash = dbchan.access_hash
+        matcher = _routes.get(chan_id)
+        limiter = get_limiter(client)
+        peer = await get_input_channel(client, chan_id, access_hash)
+        max_backlog = int(getdefault(bot, "max_backlog"))
+        if max_backlog and getdefault(bot, "summarize_overflow") == "1":
+            last_msg = await _skip_overflow(bot, client, peer, last_msg, max_backlog)
+
+        count = 0
+        while not max_backlog or count < max_backlog:
+            limit = _BATCH_SIZE
+            if max_backlog:
+                limit = min(limit, max_backlog - count)
+            messages = await limiter.call(
+                "history",
+                client.get_messages,
+                peer,
+                min_id=last_msg,
+                limit=limit,
+                reverse=True,
+            )
+            bot.logger.debug(f"Channel {title!r}: fetched {len(messages)} new messages")
+            inc("messages_fetched", len(messages))
+            if not messages:
+                break
+            full = len(messages) == limit
+            if full:  # the last album may go on in the next batch
+                messages = _cut_last_album(messages)
+            # the channel comes along with the messages, no need to request it
+            channel = messages[0].chat or await limiter.call(
+                "channels", messages[0].get_chat
+            )
+            completed = await process_messages(bot, client, channel, messages, matcher)
+            await limiter.call("read", client.send_read_acknowledge, peer, messages)
+            if not completed or not full:
+                break
+            count += len(messages)
+            last_msg = messages[-1].id
+
+
+async def _skip_overflow(
+    bot: DeltaBot, client: TelegramClient, peer, last_msg: int, max_backlog: int
+) -> int:
+    """Skip the oldest new messages if there are more than ``max_backlog`` of them.
+
+    Returns the id of the last skipped message, or ``last_msg`` if nothing was skipped.
+    """
+    newest = await get_limiter(client).call(
+        "history", client.get_messages, peer, limit=1
+    )
+    # channel message ids are sequential so the gap is known without fetching it
+    if not newest or newest[0].id - last_msg <= max_backlog:
+        return last_msg
+    channel = newest[0].chat or await get_limiter(client).call(
+        "channels", newest[0].get_chat
+    )
+    skipped_to = newest[0].id - max_backlog
+    with session_scope() as session:
+        _advance_last_msg(session, channel.id, skipped_to)
+    bot.logger.debug(
+        f"Channel {channel.title!r}: skipping {skipped_to - last_msg} old messages"
+    )
+    notify_subscribers(
+        channel.id,
+        f"⚠️ Up to {skipped_to - last_msg} older posts from {channel.title!r} were"
+        f" skipped, you can read them in Telegram: {get_link(channel, last_msg + 1)}",
+    )
+    return skipped_to
+
+
+async def process_messages(
+    bot: DeltaBot, client: TelegramClient, channel, messages: list, matcher: Matcher
+) -> bool:
+    """Queue the given messages for delivery in order, saving progress after each post.
+
+    The messages of an album are delivered together as a single post.
+    ``matcher`` holds the compiled subscriptions of the channel.
+    Returns False if the rest of the messages must not be processed: the channel
+    was unsubscribed in the meantime, or a post failed and will be retried in
+    the next check.
+
+    No database session is kept open while awaiting, so commands and other
+    channels are never blocked while waiting for the network.
+    """
+    assert _dedup, "plugin not started"
+    digests = _routes.get_digests(channel.id)
+    for post in _group_albums(messages):
+        delivery, digest = None, None
+        try:
+            delivery = await tg2dc(bot, client, post, channel, matcher)
+            if delivery and digests:
+                digest = await _get_digest_post(channel, post, delivery, digests)
+        except Exception as ex:
+            bot.logger.exception(ex)
+            _discard_post(channel, post, delivery)
+            if _retry_post(bot, channel, post):
+                return False
+            delivery, digest = None, None
+        chats: List[int] = []
+        try:
+            with session_scope() as session:
+                dbchan = session.query(Channel).filter_by(id=channel.id).first()
+                if not dbchan:
+                    _discard_post(channel, post, delivery, digest)
+                    return False
+                if delivery:
+                    chats = [
+                        chat_id for chat_id in delivery[0] if chat_id not in digests
+                    ]
+                    for args in delivery[1]:
+                        enqueue(session, chats, args)
+                if digest:
+                    add_post(session, channel.id, *digest)
+                dbchan.title = channel.title
+                _advance_last_msg(session, channel.id, post[-1].id)
+                if post[0].date:
+                    dbchan.last_post, dbchan.post_interval = update_activity(
+                        dbchan.last_post,
+                        dbchan.post_interval,
+                        int(post[0].date.timestamp()),
+                    )
+        except BaseException:  # not queued, other channels may deliver the post
+            _discard_post(channel, post, delivery, digest)
+            raise
+        _post_attempts.pop((channel.id, post[-1].id), None)
+        if delivery:
+            _dedup.add(delivery[0], get_post_keys(post, channel.id), channel.id)
+            if chats:
+                notify_workers()
+            else:  # the post only goes to digests
+                remove_spools([delivery[1][0]["spool"]])
+    return True
+
+
+def _discard_post(
+    channel, post: list, delivery: Optional[tuple], digest: tuple = None
+) -> None:
+    """Remove the files of a post that won't be queued and release its dedup keys."""
+    if delivery:
+        assert _dedup, "plugin not started"
+        _dedup.release(delivery[0], get_post_keys(post, channel.id))
+        remove_spools([delivery[1][0]["spool"]])
+    if digest:
+        remove_spools([digest[2]])
+
+
+def _advance_last_msg(session, chan_id: int, msg_id: int) -> None:
+    """Set the last processed message of a channel, it never goes backwards."""
+    session.query(Channel).filter(
+        Channel.id == chan_id, Channel.last_msg < msg_id
+    ).update({Channel.last_msg: msg_id}, synchronize_session=False)
+
+
+def _retry_post(bot: DeltaBot, channel, post: list) -> bool:
+    """Count a failed attempt to process a post.
+
+    Returns True if the post must be retried, False to skip it after too many attempts.
+    """
+    key = (channel.id, post[-1].id)
+    attempts = _post_attempts.pop(key, 0) + 1
+    if attempts < _MAX_POST_ATTEMPTS:
+        _post_attempts[key] = attempts
+        return True
+    bot.logger.warning(
+        f"Channel {channel.title!r}: skipping post {post[-1].id}"
+        f" after {attempts} failed attempts"
     )
-    with TemporaryDirectory() as tempdir:
-        if msg.file and msg.file.size <= int(getdefault(bot, "max_size")):
-            args["filename"] = await msg.download_media(tempdir)
-            if args["filename"] and msg.sticker:
+    return False
+
+
+async def _get_digest_post(
+    channel, post: list, delivery: tuple, digests: dict
+) -> Optional[Tuple[list, str, Optional[str]]]:
+    """Render a post for the digests of the chats that get the channel's posts in digests."""
+    chats = [chat_id for chat_id in delivery[0] if chat_id in digests]
+    if not chats:
+        return None
+    images = [
+        args["filename"]
+        for args in delivery[1]
+        if args.get("filename")
+        and (mimetypes.guess_type(args["filename"])[0] or "").startswith("image/")
+    ]
+    html = post2html(delivery[1][0]["text"], get_link(channel, post[0].id))
+    # the delivery's spool is removed once delivered, the digest keeps its own copy
+    spool = await asyncio.get_event_loop().run_in_executor(None, save_images, images)
+    return chats, html, spool
+
+
+def _cut_last_album(messages: list) -> list:
+    """Leave out the album at the end of the given messages, unless there is nothing else."""
+    album = messages[-1].grouped_id
+    if not album:
+        return messages
+    cut = len(messages)
+    while cut and messages[cut - 1].grouped_id == album:
+        cut -= 1
+    return messages[:cut] or messages
+
+
+def _group_albums(messages: list) -> List[list]:
+    """Split the given messages in posts, the messages of an album are one post."""
+    posts: List[list] = []
+    for msg in messages:
+        if msg.grouped_id and posts and posts[-1][0].grouped_id == msg.grouped_id:
+            posts[-1].append(msg)
+        else:
+            posts.append([msg])
+    return posts
+
+
+async def tg2dc(
+    bot: DeltaBot, client: TelegramClient, post: list, channel, matcher: Matcher
+) -> Optional[Tuple[list, List[dict]]]:
+    """Prepare a Telegram post, a message or an album, to be queued for delivery.
+
+    Returns the chats that must receive it and the arguments for :func:`enqueue`
+    of each message to send, or None if there is nothing to deliver.
+    """
+    texts = [msg.text for msg in post if msg.text is not None]
+    if not texts:
+        return None
+    text = next((text for text in texts if text), "")
+    assert _dedup, "plugin not started"
+    # chats subscribed to several channels may have got the post already
+    keys = get_post_keys(post, channel.id)
+    # the keys are reserved until the post is queued, see process_messages()
+    chats = _dedup.unseen(matcher.match(text), keys, channel.id)
+    if not chats:
+        return None
+    sender = channel.title or "Unknown"
+    args = dict(text=text, sender=sender, spool=None)
+    deliveries = [args]
+    spool = make_spool_dir()
+    try:
+        max_size = int(getdefault(bot, "max_size"))
+        media = [msg for msg in post if msg.file and msg.file.size <= max_size]
+        # the files of an album get a folder each, they may have the same name
+        paths = await asyncio.gather(
+            *(
+                download_media(
+                    client,
+                    msg,
+                    _make_dir(spool, str(msg.id)) if len(post) > 1 else spool,
+                )
+                for msg in media
+            )
+        )
+        photos = [path for msg, path in zip(media, paths) if path and msg.photo]
+        files = [path for path in paths if path]
+        if len(photos) > 1:  # show the photos of the album as a gallery
+            album_path = os.path.join(spool, "album.html")
+            with open(album_path, "w", encoding="utf-8") as file:
+                file.write(await album2html(text, photos, _get_img_options(bot)))
+            args["html"] = album_path
+            files = [photos[0]] + [path for path in files if path not in photos]
+        if files:
+            args["filename"] = files[0]
+            if len(post) == 1 and post[0].sticker:
                 args["viewtype"] = "sticker"
+        # a message can have a single attachment, the rest of the album follows
+        for path in files[1:]:
+            deliveries.append(dict(sender=sender, filename=path))
+
+        msg = post[0]
         if msg.web_preview and msg.web_preview.cached_page:
-            args["html"] = await page2html(
-                msg.web_preview.cached_page.blocks,
-                client=client,
-                msg=msg,
-                logger=bot.logger,
+            assert _page_cache, "plugin not started"
+            page_path = os.path.join(spool, "page.html")
+            await _page_cache.get(
+                f"{msg.web_preview.id}-{msg.web_preview.hash}",
+                page_path,
+                partial(
+                    write_page,
+                    msg.web_preview.cached_page.blocks,
+                    context=RenderContext(
+                        client=client,
+                        msg=msg,
+                        logger=bot.logger,
+                        limiter=get_limiter(client),
+                        img_options=_get_img_options(bot),
+                    ),
+                ),
             )
-        if not any([args.get("text"), args.get("filename"), args.get("html")]):
-            return
-        for subs in dbchan.subscriptions:
-            if subs.filter in msg.text:
-                try:
-                    replies.add(**args, chat=bot.get_chat(int(subs.chat_id)))
-                    replies.send_reply_messages()
-                except Exception as ex:
-                    bot.logger.exception(ex)
+            args["html"] = page_path
+    except BaseException:
+        remove_spools([spool])
+        _dedup.release(chats, keys)
+        raise
+    if files or args.get("html"):
+        for delivery in deliveries:
+            delivery["spool"] = spool
+    else:
+        remove_spools([spool])
+        if not text:
+            _dedup.release(chats, keys)
+            return None
+    return chats, deliveries
 
 
-@sync
-async def leave_channels(bot, *args) -> None:
-    try:
-        client = get_client(bot)
-        await client.connect()
-        for chan_id in args:
-            await client.delete_dialog(PeerChannel(chan_id))
-    except Exception as ex:
-        bot.logger.exception(ex)
-    finally:
-        await client.disconnect()
+def _make_dir(*parts: str) -> str:
+    path = os.path.join(*parts)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _get_img_options(bot: DeltaBot) -> ImageOptions:
+    return ImageOptions(
+        max_width=int(getdefault(bot, "img_max_width")),
+        img_format=getdefault(bot, "img_format"),
+        quality=int(getdefault(bot, "img_quality")),
+        page_budget=int(getdefault(bot, "img_page_budget")),
+    )
+
+
+async def download_media(client: TelegramClient, msg, directory: str) -> Optional[str]:
+    """Download the media of the given message into ``directory``.
+
+    Photos and documents are cached by ID, so media reposted by several
+    channels is only downloaded once.
+    """
+
+    async def download(folder: str) -> Optional[str]:
+        path = await get_limiter(client).call("download", msg.download_media, folder)
+        if path:
+            inc("bytes_downloaded", os.path.getsize(path))
+        return path
+
+    media = msg.photo or msg.document
+    if media is None:
+        return await download(directory)
+    assert _media_cache, "plugin not started"
+    key = f"{type(media).__name__.lower()}-{media.id}"
+    return await _media_cache.get(key, directory, download)
+
+
+def notify_subscribers(chan_id: int, text: str) -> None:
+    """Send a notice to all the chats subscribed to the given channel."""
+    with session_scope() as session:
+        enqueue(session, _routes.get(chan_id).chats, dict(text=text))
+    notify_workers()
+
+
+def get_subscriptions(session) -> Dict[int, list]:
+    """Get the ``(chat ID, filter, digest)`` subscriptions of each channel."""
+    query = session.query(
+        Subscription.chan_id,
+        Subscription.chat_id,
+        Subscription.filter,
+        Subscription.digest,
+    )
+    subscriptions: Dict[int, list] = {}
+    for chan, chat_id, filter_, digest in query:
+        subscriptions.setdefault(chan, []).append((chat_id, filter_, digest))
+    return subscriptions
+
+
+def get_link(channel, msg_id: int) -> str:
+    """Get the public link of a channel's message."""
+    if channel.username:
+        return f"https://t.me/{channel.username}/{msg_id}"
+    return f"https://t.me/c/{channel.id}/{msg_id}"
+
+
+def _get_lock(chan_id: int) -> asyncio.Lock:
+    """Get the lock that serializes deliveries of the given channel."""
+    lock = _locks.get(chan_id)
+    if lock is None:
+        lock = _locks[chan_id] = asyncio.Lock()
+    return lock
@@ -0,0 +1,225 @@
+"""Caches of rendered Instant View pages and downloaded media."""
+
+import asyncio
+import os
+import shutil
+from collections import OrderedDict
+from typing import IO, Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+
+class _LRU:
+    """Bookkeeping of a cache tier: entries with a size, least recently used first.
+
+    :param max_size: maximum total size of the entries.
+    """
+
+    def __init__(self, max_size: int) -> None:
+        self.max_size = max_size
+        self.size = 0
+        self._entries: Dict[str, Tuple[Any, int]] = OrderedDict()
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._entries
+
+    def get(self, key: str) -> Any:
+        """Get the value of an entry, marking it as the most recently used."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        self._entries.move_to_end(key)  # type: ignore
+        return entry[0]
+
+    def put(self, key: str, value: Any, size: int) -> None:
+        """Add or replace an entry, call ``evict()`` to get back under the limit."""
+        self.pop(key)
+        self._entries[key] = (value, size)
+        self.size += size
+
+    def pop(self, key: str) -> Any:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return None
+        self.size -= entry[1]
+        return entry[0]
+
+    def evict(self) -> List[Tuple[str, Any]]:
+        """Remove the least recently used entries over the limit, return them."""
+        evicted = []
+        while self.size > self.max_size:
+            key, (value, size) = self._entries.popitem(last=False)  # type: ignore
+            self.size -= size
+            evicted.append((key, value))
+        return evicted
+
+
+# used through get() only, the bookkeeping is in _LRU
+class PageCache:  # pylint: disable=R0903
+    """LRU cache of rendered pages on disk.
+
+    Pages are rendered straight into their file and handed out as hard links,
+    like in MediaCache, so no page is ever held in memory.
+
+    :param directory: folder where the pages are stored.
+    :param max_size: maximum size in bytes of the stored pages.
+    """
+
+    def __init__(self, directory: str, max_size: int) -> None:
+        self.directory = directory
+        self._pages = _LRU(max_size)
+        self._pending: Dict[str, asyncio.Future] = {}
+
+        os.makedirs(directory, exist_ok=True)
+        entries = [entry for entry in os.scandir(directory) if entry.is_file()]
+        for entry in sorted(entries, key=lambda entry: entry.stat().st_mtime):
+            if entry.name.endswith(".html"):
+                self._pages.put(entry.name[:-5], None, entry.stat().st_size)
+            else:  # interrupted render
+                os.remove(entry.path)
+        self._evict()
+
+    async def get(
+        self, key: str, path: str, render: Callable[[IO[str]], Awaitable[None]]
+    ) -> None:
+        """Save the page with the given key to ``path``.
+
+        If the page is missing, it is rendered with ``render(file)``, which must
+        write the page into the given text file.
+        Concurrent requests of the same missing page share the same render.
+        """
+        if key in self._pages:
+            self._pages.get(key)
+            os.utime(self._get_path(key))
+        else:
+            task = self._pending.get(key)
+            if task is None:
+                task = self._pending[key] = asyncio.ensure_future(
+                    self._render(key, render)
+                )
+                try:
+                    await task
+                finally:
+                    del self._pending[key]
+            else:
+                await task
+            if key not in self._pages:  # evicted meanwhile, too big for the cache
+                with open(path, "w", encoding="utf-8") as file:
+                    await render(file)
+                return
+
+        try:
+            os.link(self._get_path(key), path)
+        except OSError:
+            shutil.copyfile(self._get_path(key), path)
+        self._evict()
+
+    async def _render(
+        self, key: str, render: Callable[[IO[str]], Awaitable[None]]
+    ) -> None:
+        path = self._get_path(key)
+        tmp_path = os.path.join(self.directory, f"{key}.tmp")
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as file:
+                await render(file)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        os.replace(tmp_path, path)
+        self._pages.put(key, None, os.path.getsize(path))
+
+    def _evict(self) -> None:
+        for key, _ in self._pages.evict():
+            try:
+                os.remove(self._get_path(key))
+            except OSError:
+                pass
+
+    def _get_path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.html")
+
+
+class MediaCache:  # pylint: disable=R0903
+    """LRU cache of downloaded media files on disk, keyed by Telegram's media ID.
+
+    Files are handed out as hard links, the file system counts the references
+    so evicting a file never breaks a message still waiting to be delivered.
+
+    :param directory: folder where the files are stored.
+    :param max_size: maximum size in bytes of the stored files.
+    """
+
+    def __init__(self, directory: str, max_size: int) -> None:
+        self.directory = directory
+        self._files = _LRU(max_size)
+        self._pending: Dict[str, asyncio.Future] = {}
+
+        os.makedirs(directory, exist_ok=True)
+        entries = [entry for entry in os.scandir(directory) if entry.is_dir()]
+        for entry in sorted(entries, key=lambda entry: entry.stat().st_mtime):
+            files = os.listdir(entry.path)
+            if len(files) != 1:  # interrupted download
+                shutil.rmtree(entry.path, ignore_errors=True)
+                continue
+            path = os.path.join(entry.path, files[0])
+            self._files.put(entry.name, path, os.path.getsize(path))
+        self._evict()
+
+    async def get(
+        self,
+        key: str,
+        directory: str,
+        download: Callable[[str], Awaitable[Optional[str]]],
+    ) -> Optional[str]:
+        """Put the file with the given key in ``directory`` and return its path.
+
+        If the file is missing, it is downloaded with ``download(folder)``,
+        which must return the path of the file saved in ``folder``.
+        Concurrent requests of the same missing file share the same download.
+        """
+        src = self._files.get(key)
+        if src:
+            os.utime(os.path.dirname(src))
+        else:
+            task = self._pending.get(key)
+            if task is None:
+                task = self._pending[key] = asyncio.ensure_future(
+                    self._download(key, download)
+                )
+                try:
+                    src = await task
+                finally:
+                    del self._pending[key]
+            else:
+                src = await task
+            if not src:
+                return None
+            if key not in self._files:  # evicted meanwhile, too big for the cache
+                return await download(directory)
+
+        dest = os.path.join(directory, os.path.basename(src))
+        try:
+            os.link(src, dest)
+        except OSError:
+            shutil.copyfile(src, dest)
+        self._evict()
+        return dest
+
+    async def _download(
+        self, key: str, download: Callable[[str], Awaitable[Optional[str]]]
+    ) -> Optional[str]:
+        folder = os.path.join(self.directory, key)
+        shutil.rmtree(folder, ignore_errors=True)
+        os.makedirs(folder)
+        try:
+            path = await download(folder)
+        except BaseException:
+            shutil.rmtree(folder, ignore_errors=True)
+            raise
+        if not path:
+            shutil.rmtree(folder, ignore_errors=True)
+            return None
+        self._files.put(key, path, os.path.getsize(path))
+        return path
+
+    def _evict(self) -> None:
+        for _, path in self._files.evict():
+            shutil.rmtree(os.path.dirname(path), ignore_errors=True)
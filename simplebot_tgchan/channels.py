@@ -0,0 +1,108 @@
+"""Joining, resolving and leaving Telegram channels with the logged in sessions."""
+
+from typing import Optional
+
+from simplebot import DeltaBot
+from sqlalchemy import func
+from telethon import TelegramClient
+from telethon.tl.functions.channels import JoinChannelRequest
+from telethon.tl.functions.messages import (
+    CheckChatInviteRequest,
+    ImportChatInviteRequest,
+)
+from telethon.tl.types import InputPeerChannel, PeerChannel
+
+from .metrics import forget_channel
+from .orm import Channel, session_scope
+from .util import get_connected_client, get_limiter, get_sessions
+
+
+async def join_channel(
+    client: TelegramClient, chan: str, invite: bool, max_wait: float = None
+) -> tuple:
+    """Get the channel of a username or invite hash and the index of the session
+    that already handles it, joining the channel with ``client`` if none does.
+
+    Flood waits longer than ``max_wait`` seconds are raised instead of waited.
+    """
+    limiter = get_limiter(client)
+    if invite:
+        result = await limiter.call(
+            "join", client, CheckChatInviteRequest(chan), max_wait=max_wait
+        )
+        # the chat of an invite is unknown until joining unless it can be peeked
+        channel = getattr(result, "chat", None)
+    else:
+        channel = await limiter.call(
+            "channels", client.get_entity, chan, max_wait=max_wait
+        )
+    assert channel is None or getattr(channel, "broadcast", False), "Invalid channel"
+    owner = get_owner(channel.id) if channel else None
+    if owner is None and (channel is None or channel.left):
+        request = (
+            ImportChatInviteRequest(chan) if invite else JoinChannelRequest(channel)
+        )
+        channel = (
+            await limiter.call("join", client, request, max_wait=max_wait)
+        ).chats[0]
+        owner = get_owner(channel.id)
+        if owner not in (None, client.session.index):
+            # the channel of a private invite was already joined by another session
+            await limiter.call(
+                "leave", client.delete_dialog, channel, max_wait=max_wait
+            )
+    return channel, owner
+
+
+def get_owner(chan_id: int) -> Optional[int]:
+    """Get the index of the session that handles the given channel, if subscribed."""
+    with session_scope() as session:
+        return session.query(Channel.session).filter_by(id=chan_id).scalar()
+
+
+def get_least_loaded_session(bot: DeltaBot) -> int:
+    """Get the index of the session with less subscribed channels."""
+    load = {index: 0 for index in range(len(get_sessions(bot)))}
+    with session_scope() as session:
+        query = session.query(
+            Channel.session, func.count(Channel.id)  # pylint: disable=E1102
+        )
+        for index, count in query.group_by(Channel.session):
+            if index in load:
+                load[index] = count
+    return min(load, key=lambda index: load[index])
+
+
+async def get_input_channel(
+    client: TelegramClient, chan_id: int, access_hash: Optional[int]
+) -> InputPeerChannel:
+    """Get the input peer of a subscribed channel.
+
+    The access hash is cached in the database, the channel is only requested
+    to Telegram if it is unknown.
+    """
+    if access_hash:
+        return InputPeerChannel(chan_id, access_hash)
+    channel = await get_limiter(client).call(
+        "channels", client.get_entity, PeerChannel(chan_id)
+    )
+    with session_scope() as session:
+        dbchan = session.query(Channel).filter_by(id=chan_id).first()
+        if dbchan:
+            dbchan.title = channel.title
+            dbchan.access_hash = channel.access_hash
+    client.session.add_channel(chan_id, channel.access_hash)
+    return InputPeerChannel(chan_id, channel.access_hash)
+
+
+async def leave_channels(bot: DeltaBot, *channels) -> None:
+    """Leave the given ``(channel ID, session index)`` channels."""
+    for chan_id, index in channels:
+        forget_channel(chan_id)
+        try:
+            client = await get_connected_client(bot, index)
+            await get_limiter(client).call(
+                "leave", client.delete_dialog, PeerChannel(chan_id)
+            )
+        except Exception as ex:
+            bot.logger.exception(ex)
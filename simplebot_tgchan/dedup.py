@@ -0,0 +1,129 @@
+"""Suppression of posts a chat already got from another channel."""
+
+import hashlib
+import re
+import time
+from collections import OrderedDict
+from threading import Lock
+from typing import Dict, List, Set, Tuple
+
+from telethon.tl.types import PeerChannel
+
+
+def get_post_keys(post: list, chan_id: int) -> List[str]:
+    """Get the keys that identify a post, a message or an album, across channels.
+
+    A post is identified by its origin, the channel and ID of the forwarded
+    message or its own, and by a hash of its text and media to catch copies.
+    """
+    msg = post[0]
+    fwd = msg.fwd_from
+    if fwd and isinstance(fwd.from_id, PeerChannel) and fwd.channel_post:
+        keys = [f"origin:{fwd.from_id.channel_id}:{fwd.channel_post}"]
+    else:
+        keys = [f"origin:{chan_id}:{msg.id}"]
+
+    text = " ".join(_normalize(item.text or "") for item in post).strip()
+    media = [
+        str((item.photo or item.document).id)
+        for item in post
+        if item.photo or item.document
+    ]
+    if text or media:
+        content = "\n".join([text, *media]).encode()
+        keys.append(f"hash:{hashlib.sha1(content).hexdigest()}")
+    return keys
+
+
+def _normalize(text: str) -> str:
+    return re.sub(r"\s+", " ", text).strip().lower()
+
+
+class DedupIndex:
+    """Bounded index of the posts each chat got recently, and from which channel.
+
+    Only copies coming from another channel are suppressed, a channel posting
+    the same text twice is delivered as usual.
+
+    :param ttl: seconds a post is remembered.
+    :param max_size: maximum number of (chat, key) entries remembered.
+    """
+
+    def __init__(self, ttl: int, max_size: int = 100000) -> None:
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries: Dict[Tuple[int, str], Tuple[float, int]] = OrderedDict()
+        # the new entries of reservations not confirmed or released yet
+        self._reserved: Set[Tuple[int, str]] = set()
+        self._lock = Lock()
+
+    def unseen(self, chats: List[int], keys: List[str], chan_id: int) -> List[int]:
+        """Get the chats that didn't get a post with any of the given keys from
+        a channel other than ``chan_id`` yet.
+
+        The keys are reserved for the returned chats right away, so a copy checked
+        meanwhile in another channel is suppressed. Call :meth:`add` once the post
+        is queued or :meth:`release` if it failed.
+        """
+        if not self.ttl:
+            return chats
+        with self._lock:
+            now = time.time()
+            self._expire(now)
+            chats = [
+                chat_id
+                for chat_id in chats
+                if not any(
+                    self._entries.get((chat_id, key), (0, chan_id))[1] != chan_id
+                    for key in keys
+                )
+            ]
+            for chat_id in chats:
+                for key in keys:
+                    if (chat_id, key) not in self._entries:
+                        self._reserved.add((chat_id, key))
+                    self._put((chat_id, key), now, chan_id)
+            self._expire(now)
+        return chats
+
+    def add(self, chats: List[int], keys: List[str], chan_id: int) -> None:
+        """Record the post with the given keys as delivered from ``chan_id`` to ``chats``.
+
+        Call it only once the post is queued for delivery, so a post that
+        failed is not suppressed in the other channels.
+        """
+        if not self.ttl:
+            return
+        with self._lock:
+            now = time.time()
+            for chat_id in chats:
+                for key in keys:
+                    self._reserved.discard((chat_id, key))
+                    self._put((chat_id, key), now, chan_id)
+            self._expire(now)
+
+    def release(self, chats: List[int], keys: List[str]) -> None:
+        """Undo the reservation made by :meth:`unseen` for a post that failed."""
+        if not self.ttl:
+            return
+        with self._lock:
+            for chat_id in chats:
+                for key in keys:
+                    # entries that existed before belong to the same channel, keep them
+                    if (chat_id, key) in self._reserved:
+                        self._reserved.discard((chat_id, key))
+                        self._entries.pop((chat_id, key), None)
+
+    def _put(self, entry: Tuple[int, str], now: float, chan_id: int) -> None:
+        # re-insert to keep the entries in expiration order
+        self._entries.pop(entry, None)
+        self._entries[entry] = (now + self.ttl, chan_id)
+
+    def _expire(self, now: float) -> None:
+        # entries are kept in insertion order, which is also their expiration order
+        while self._entries and (
+            len(self._entries) > self.max_size
+            or next(iter(self._entries.values()))[0] <= now
+        ):
+            entry, _ = self._entries.popitem(last=False)  # type: ignore
+            self._reserved.discard(entry)
@@ -0,0 +1,178 @@
+"""Digests: the posts of a channel delivered together periodically."""
+
+import html
+import os
+import re
+import shutil
+import time
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy import or_
+
+from .instantview import ImageOptions, encode_image
+from .orm import DigestEntry, DigestPost, Subscription, session_scope
+from .outbox import enqueue, make_spool_dir, remove_spools
+
+_UNITS = {"s": 1, "m": 60, "h": 60 * 60, "d": 60 * 60 * 24}
+# digests can have many posts, keep their images small
+_MAX_IMG_WIDTH = 400
+
+
+def parse_duration(text: str) -> int:
+    """Parse a duration like ``90``, ``30m``, ``1h`` or ``1d``, returns seconds."""
+    match = re.fullmatch(r"(\d+)([smhd]?)", text.strip().lower())
+    if not match or not int(match.group(1)):
+        raise ValueError(f"invalid duration: {text!r}")
+    return int(match.group(1)) * _UNITS[match.group(2) or "s"]
+
+
+def post2html(text: str, link: str) -> str:
+    """Render the text of a post as part of a digest, its images are added on flush."""
+    parts = []
+    if text:
+        parts.append(f"<p>{html.escape(text)}</p>".replace("\n", "<br>"))
+    parts.append(f'<p><a href="{link}">{link}</a></p>')
+    return "".join(parts)
+
+
+def save_images(images: List[str]) -> Optional[str]:
+    """Keep the images of a post until its digests are sent, returns their spool directory."""
+    if not images:
+        return None
+    spool = make_spool_dir()
+    try:
+        for index, path in enumerate(images):
+            dest = os.path.join(spool, f"{index:03}{os.path.splitext(path)[1]}")
+            try:
+                os.link(path, dest)
+            except OSError:
+                shutil.copyfile(path, dest)
+    except Exception:
+        remove_spools([spool])
+        raise
+    return spool
+
+
+def add_post(
+    session, chan_id: int, chats: Iterable[int], post_html: str, spool: str = None
+) -> None:
+    """Add a post, rendered with :func:`post2html`, to the next digest of the given chats.
+
+    ``spool`` is the directory with the post's images, see :func:`save_images`.
+    """
+    post = DigestPost(chan_id=chan_id, html=post_html, spool=spool)
+    post.entries = [DigestEntry(chat_id=chat_id) for chat_id in chats]
+    session.add(post)
+
+
+def discard_posts(session, chat_id: int, chan_id: int = None) -> List[str]:
+    """Forget the posts waiting for the digests of a chat, only of the given channel if any.
+
+    Returns the spool directories to remove once the transaction is committed.
+    """
+    query = session.query(DigestEntry).filter_by(chat_id=chat_id)
+    if chan_id is not None:
+        query = query.join(DigestPost).filter(DigestPost.chan_id == chan_id)
+    for entry in query:
+        session.delete(entry)
+    return _delete_orphans(session)
+
+
+async def flush_digests(img_options: ImageOptions) -> bool:
+    """Queue the due digests for delivery, returns True if any digest was queued."""
+    now = time.time()
+    digests = []
+    with session_scope() as session:
+        due = session.query(Subscription).filter(
+            Subscription.digest.isnot(None),
+            or_(Subscription.digest_at.is_(None), Subscription.digest_at <= now),
+        )
+        for subs in due.all():
+            subs.digest_at = now + subs.digest
+            posts = (
+                session.query(DigestPost.id, DigestPost.html, DigestPost.spool)
+                .join(DigestEntry)
+                .filter(
+                    DigestEntry.chat_id == subs.chat_id,
+                    DigestPost.chan_id == subs.chan_id,
+                )
+                .order_by(DigestPost.id)
+                .all()
+            )
+            if posts:
+                digests.append((subs.chat_id, subs.channel.title, posts))
+    if not digests:
+        return False
+
+    # images are only encoded now, no database session is held meanwhile
+    img_options = img_options._replace(
+        max_width=min(img_options.max_width, _MAX_IMG_WIDTH)
+    )
+    images: Dict[str, str] = {}
+    spools: List[str] = []
+    try:
+        for _, title, posts in digests:
+            spool = make_spool_dir()
+            spools.append(spool)
+            with open(
+                os.path.join(spool, "digest.html"), "w", encoding="utf-8"
+            ) as file:
+                file.write(
+                    '<!DOCTYPE html><html><meta charset="UTF-8">'
+                    '<meta name="viewport" content="width=device-width, initial-scale=1.0">'
+                    f"</head><body><h1>{html.escape(title or '')}</h1>"
+                )
+                for _, post_html, post_spool in posts:
+                    if post_spool and post_spool not in images:
+                        images[post_spool] = await _images2html(post_spool, img_options)
+                    file.write(
+                        f"<div>{images.get(post_spool, '')}{post_html}</div><hr>"
+                    )
+                file.write("</body></html>")
+    except Exception:
+        remove_spools(spools)
+        raise
+
+    with session_scope() as session:
+        for (chat_id, title, posts), spool in zip(digests, spools):
+            text = f"📰 {len(posts)} new posts from {title!r}"
+            path = os.path.join(spool, "digest.html")
+            enqueue(
+                session,
+                [chat_id],
+                dict(text=text, sender=title, html=path, spool=spool),
+            )
+            session.query(DigestEntry).filter(
+                DigestEntry.chat_id == chat_id,
+                DigestEntry.post_id.in_([post[0] for post in posts]),
+            ).delete(synchronize_session=False)
+        unused = _delete_orphans(session)
+    remove_spools(unused)
+    return True
+
+
+async def _images2html(spool: str, img_options: ImageOptions) -> str:
+    """Inline the images of a post, as many as its budget allows."""
+    parts = []
+    budget = img_options.page_budget or float("inf")
+    for name in sorted(os.listdir(spool)):
+        with open(os.path.join(spool, name), "rb") as file:
+            mime, data = await encode_image(file.read(), img_options)
+        if len(data) <= budget:
+            budget -= len(data)
+            parts.append(f'<img src="data:{mime};base64,{data}" style="width:100%"/>')
+    return "".join(parts)
+
+
+def _delete_orphans(session) -> List[str]:
+    """Delete the posts no digest is waiting for anymore.
+
+    Returns the spool directories of their images.
+    """
+    session.flush()
+    spools = []
+    for post in session.query(DigestPost).filter(~DigestPost.entries.any()):
+        if post.spool:
+            spools.append(post.spool)
+        session.delete(post)
+    return spools
@@ -0,0 +1,167 @@
+"""Subscription filters.
+
+A filter is a keyword that must be in a post for it to be delivered to a chat,
+optionally prefixed with a mode:
+
+- ``i:`` case-insensitive keyword.
+- ``w:`` whole-word keyword.
+- ``iw:`` case-insensitive whole-word keyword.
+- ``re:`` regular expression.
+
+All the filters of a channel are compiled into a single :class:`Matcher`, with
+many keywords each post is scanned once no matter how many chats are subscribed.
+Case-insensitive keywords are compared case-folded.
+"""
+
+import re
+from collections import deque
+from typing import Dict, Iterable, List, NamedTuple, Optional, Pattern, Tuple, Union
+
+_MODES = ("iw", "i", "w", "re")
+# below this many keywords, str.find() per keyword beats the pure Python automaton
+_AUTOMATON_MIN_KEYWORDS = 300
+
+
+class Filter(NamedTuple):
+    pattern: Union[str, Pattern]
+    ignore_case: bool = False
+    whole_word: bool = False
+
+
+def parse_filter(filter_: str) -> Filter:
+    """Parse a subscription filter, raises ``re.error`` if the regex is invalid."""
+    mode, sep, pattern = filter_.partition(":")
+    if not sep or mode not in _MODES:
+        return Filter(filter_)
+    if mode == "re":
+        return Filter(re.compile(pattern))
+    return Filter(
+        pattern.casefold() if "i" in mode else pattern, "i" in mode, "w" in mode
+    )
+
+
+class _Automaton:  # pylint: disable=R0903
+    """Aho-Corasick automaton to find all the occurrences of several keywords."""
+
+    def __init__(self, keywords: Iterable[str]) -> None:
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[List[int]] = [[]]
+        self.keywords = list(keywords)
+        for index, keyword in enumerate(self.keywords):
+            state = 0
+            for char in keyword:
+                nxt = self._goto[state].get(char)
+                if nxt is None:
+                    nxt = self._goto[state][char] = len(self._goto)
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append([])
+                state = nxt
+            self._out[state].append(index)
+
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, nxt in self._goto[state].items():
+                queue.append(nxt)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[nxt] = self._goto[fail].get(char, 0)
+                self._out[nxt] += self._out[self._fail[nxt]]
+
+    def search(self, text: str) -> Iterable[Tuple[int, int]]:
+        """Yield ``(keyword index, end position)`` for each occurrence in ``text``."""
+        goto, fail, out = self._goto, self._fail, self._out
+        state = 0
+        for pos, char in enumerate(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for index in out[state]:
+                yield index, pos
+
+
+def _find_all(keywords: List[str], text: str) -> Iterable[Tuple[int, int]]:
+    """Same as ``_Automaton.search()``, searching each keyword on its own."""
+    for index, keyword in enumerate(keywords):
+        pos = text.find(keyword)
+        while pos != -1:
+            yield index, pos + len(keyword) - 1
+            pos = text.find(keyword, pos + 1)
+
+
+class _Keywords(NamedTuple):
+    """The keywords of a channel's filters and the ``(chat, whole word)`` of each."""
+
+    keywords: List[str]
+    chats: List[list]
+    automaton: Optional[_Automaton]
+
+    def search(self, text: str) -> Iterable[Tuple[int, int]]:
+        if self.automaton:
+            return self.automaton.search(text)
+        return _find_all(self.keywords, text)
+
+
+def _is_word_char(text: str, pos: int) -> bool:
+    return 0 <= pos < len(text) and (text[pos].isalnum() or text[pos] == "_")
+
+
+class Matcher:
+    """All the subscriptions of a channel compiled to be matched in a single pass."""
+
+    def __init__(self, subscriptions: Iterable[Tuple[int, str]]) -> None:
+        self.subscriptions = tuple(subscriptions)
+        self.chats: List[int] = []
+        self._always: List[int] = []
+        self._regexes: List[Tuple[int, Pattern]] = []
+        keywords: Tuple[Dict[str, list], Dict[str, list]] = ({}, {})
+        for chat_id, filter_ in self.subscriptions:
+            self.chats.append(chat_id)
+            if not filter_:
+                self._always.append(chat_id)
+                continue
+            try:
+                pattern, ignore_case, whole_word = parse_filter(filter_)
+            except re.error:
+                continue
+            if isinstance(pattern, str):
+                keywords[ignore_case].setdefault(pattern, []).append(
+                    (chat_id, whole_word)
+                )
+            else:
+                self._regexes.append((chat_id, pattern))
+        self._keywords = tuple(
+            _Keywords(
+                list(kws),
+                list(kws.values()),
+                _Automaton(kws) if len(kws) >= _AUTOMATON_MIN_KEYWORDS else None,
+            )
+            for kws in keywords
+        )
+
+    def __len__(self) -> int:
+        return len(self.chats)
+
+    def match(self, text: str) -> List[int]:
+        """Get the IDs of the chats that must receive a post with the given text."""
+        matched = set(self._always)
+        for ignore_case, keywords in enumerate(self._keywords):
+            if not keywords.keywords:
+                continue
+            # word boundaries are checked in the same string that was searched
+            haystack = text.casefold() if ignore_case else text
+            for index, end in keywords.search(haystack):
+                start = end - len(keywords.keywords[index]) + 1
+                for chat_id, whole_word in keywords.chats[index]:
+                    if not whole_word or not (
+                        _is_word_char(haystack, start - 1)
+                        or _is_word_char(haystack, end + 1)
+                    ):
+                        matched.add(chat_id)
+        for chat_id, regex in self._regexes:
+            if chat_id not in matched and regex.search(text):
+                matched.add(chat_id)
+        return [chat_id for chat_id in self.chats if chat_id in matched]
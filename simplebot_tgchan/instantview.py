@@ -11,232 +11,416 @@ PageBlockVideo
 
 # pylama:ignore=C0103
 
+import asyncio
 import base64
 import html
+import io
+import time
+from typing import Any, List, NamedTuple, Optional, Tuple
 
+from PIL import Image
+from telethon.tl import types
+from telethon.tl.tlobject import TLObject
 
-async def _download_image(logger, client, img) -> str:
+from .metrics import inc, observe
+
+
+class ImageOptions(NamedTuple):
+    """How the images of the pages are embedded."""
+
+    max_width: int = 800
+    img_format: str = "JPEG"
+    quality: int = 75
+    # maximum bytes of images per page, 0 means no limit
+    page_budget: int = 1024**2 * 2
+
+
+class RenderContext(NamedTuple):
+    """Where the images of a page are downloaded from and how they are embedded.
+
+    ``msg`` is the message with the page, images are downloaded with ``client``
+    through ``limiter`` if given, at most ``max_downloads`` at a time.
+    """
+
+    client: Any = None
+    msg: Any = None
+    logger: Any = None
+    limiter: Any = None
+    max_downloads: int = 4
+    img_options: ImageOptions = ImageOptions()
+
+
+def is_supported_format(img_format: str) -> bool:
+    """Check if images can be saved in the given format."""
+    Image.init()
+    return img_format.upper() in Image.SAVE
+
+
+def _transcode(data: bytes, options: ImageOptions) -> Tuple[str, bytes]:
+    """Downscale and recompress the given image, return its MIME type and data."""
+    with Image.open(io.BytesIO(data)) as img:
+        mime = Image.MIME.get(img.format or "", "image/png")
+        resize = img.width > options.max_width
+        if resize:
+            height = max(img.height * options.max_width // img.width, 1)
+            img = img.resize((options.max_width, height))
+        img_format = options.img_format.upper()
+        if img_format == "JPEG" and img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        output = io.BytesIO()
+        img.save(output, format=img_format, quality=options.quality)
+    if not resize and output.tell() >= len(data):
+        return mime, data
+    return Image.MIME.get(img_format, "image/jpeg"), output.getvalue()
+
+
+async def _download_image(img, context: RenderContext) -> Optional[Tuple[str, str]]:
+    """Download an image, return its MIME type and base64 data."""
+    client = context.client
     try:
-        return base64.b64encode(await client.download_media(img, bytes)).decode()
+        if context.limiter:
+            data = await context.limiter.call(
+                "download", client.download_media, img, bytes
+            )
+        else:
+            data = await client.download_media(img, bytes)
+        inc("bytes_downloaded", len(data))
+        return await encode_image(data, context.img_options)
     except Exception as ex:
-        logger.exception(ex)
-        return ""
+        context.logger.exception(ex)
+        return None
 
 
-async def page2html(blocks: list, client=None, msg=None, logger=None) -> str:
-    html_text = await blocks2html(blocks, client=client, msg=msg, logger=logger)
-    return (
+async def encode_image(data: bytes, options: ImageOptions) -> Tuple[str, str]:
+    """Transcode an image, return its MIME type and base64 data."""
+    try:
+        # image processing is CPU bound, don't block the event loop
+        mime, data = await asyncio.get_event_loop().run_in_executor(
+            None, _transcode, data, options
+        )
+    except (
+        OSError,
+        KeyError,
+        ValueError,
+        SyntaxError,
+        Image.DecompressionBombError,
+    ):  # unsupported or broken image, embed it as it is
+        mime = "image/png"
+    return mime, base64.b64encode(data).decode()
+
+
+def _get_photo(msg, photo_id: int):
+    try:
+        if msg.web_preview.photo.id == photo_id:
+            return msg.web_preview.photo
+    except AttributeError:
+        pass
+    try:
+        if msg.media.webpage.photo.id == photo_id:
+            return msg.media.webpage.photo
+    except AttributeError:
+        pass
+    for pic in msg.web_preview.cached_page.photos:
+        if pic.id == photo_id:
+            return pic
+    return None
+
+
+def _get_document(msg, document_id: int):
+    for doc in msg.web_preview.cached_page.documents:
+        if doc.id == document_id:
+            return doc
+    return None
+
+
+def _collect_images(block, msg, images: dict) -> None:
+    """Find the photos and documents referenced in the given block tree."""
+    if isinstance(block, list):
+        for item in block:
+            _collect_images(item, msg, images)
+    elif isinstance(block, TLObject):
+        name = type(block).__name__
+        if name == "PageBlockPhoto" and block.photo_id not in images:
+            images[block.photo_id] = _get_photo(msg, block.photo_id)
+        elif name == "TextImage" and block.document_id not in images:
+            images[block.document_id] = _get_document(msg, block.document_id)
+        for value in block.__dict__.values():
+            if isinstance(value, (list, TLObject)):
+                _collect_images(value, msg, images)
+
+
+async def _download_images(blocks: list, context: RenderContext) -> dict:
+    """Download all the images of the page concurrently.
+
+    Returns a dictionary mapping the photo/document ID to its MIME type and
+    base64 data, images exceeding the page budget are left out.
+    """
+    media: dict = {}
+    _collect_images(blocks, context.msg, media)
+    semaphore = asyncio.Semaphore(context.max_downloads)
+
+    async def download(img) -> Optional[Tuple[str, str]]:
+        async with semaphore:
+            return await _download_image(img, context)
+
+    ids = [media_id for media_id, img in media.items() if img]
+    results = await asyncio.gather(*(download(media[media_id]) for media_id in ids))
+    images = {}
+    budget = context.img_options.page_budget or float("inf")
+    for media_id, image in zip(ids, results):  # in the order they appear in the page
+        if image and len(image[1]) <= budget:
+            images[media_id] = image
+            budget -= len(image[1])
+    return images
+
+
+async def album2html(
+    text: str, paths: List[str], img_options: ImageOptions = ImageOptions()
+) -> str:
+    """Render the photos of an album, given the paths of the files, as a gallery."""
+
+    async def encode(path: str) -> Tuple[str, str]:
+        with open(path, "rb") as file:
+            return await encode_image(file.read(), img_options)
+
+    images = await asyncio.gather(*(encode(path) for path in paths))
+    out = io.StringIO()
+    out.write(
+        '<!DOCTYPE html><html><meta charset="UTF-8">'
+        '<meta name="viewport" content="width=device-width, initial-scale=1.0">'
+        "</head><body>"
+    )
+    if text:
+        caption = html.escape(text).replace("\n", "<br>")
+        out.write(f"<p>{caption}</p>")
+    budget = img_options.page_budget or float("inf")
+    for mime, data in images:
+        if len(data) <= budget:
+            budget -= len(data)
+            out.write(
+                f'<p><img src="data:{mime};base64,{data}" style="width:100%"/></p>'
+            )
+    out.write("</body></html>")
+    return out.getvalue()
+
+
+async def page2html(blocks: list, context: RenderContext = RenderContext()) -> str:
+    out = io.StringIO()
+    await write_page(blocks, out, context)
+    return out.getvalue()
+
+
+async def write_page(
+    blocks: list, out, context: RenderContext = RenderContext()
+) -> None:
+    """Render the page into the file-like object ``out``."""
+    start = time.monotonic()
+    # first download all images at once, then render the page without awaiting
+    images = await _download_images(blocks, context)
+    out.write(
         '<!DOCTYPE html><html><meta charset="UTF-8">'
         '<meta name="viewport" content="width=device-width, initial-scale=1.0">'
-        f"</head><body>{html_text}</body></html>"
+        "</head><body>"
     )
+    blocks2html(blocks, out, images=images)
+    out.write("</body></html>")
+    observe("page_render_seconds", time.monotonic() - start)
 
 
-async def blocks2html(blocks: list, **kwargs) -> str:
-    html_text = ""
+def blocks2html(blocks: list, out, **kwargs) -> None:
     for block in blocks:
-        html_text += await block2html(block, **kwargs)
-    return html_text
+        block2html(block, out, **kwargs)
+
+
+def block2html(block, out, **kwargs) -> None:
+    to_html = _HANDLERS.get(type(block))
+    if to_html:
+        to_html(block, out, **kwargs)
 
 
-async def block2html(block, **kwargs) -> str:
-    to_html = globals().get(type(block).__name__ + "2HTML")
-    return (await to_html(block, **kwargs)) if to_html else ""
+def _wrap(block, out, start: str, end: str, **kwargs) -> None:
+    out.write(start)
+    block2html(block, out, **kwargs)
+    out.write(end)
 
 
-async def TextPlain2HTML(block, **kwargs) -> str:  # noqa
-    return html.escape(block.text).replace("\n", "<br>")
+def _render(block, **kwargs) -> str:
+    out = io.StringIO()
+    block2html(block, out, **kwargs)
+    return out.getvalue()
 
 
-async def TextFixed2HTML(block, **kwargs) -> str:
-    return await block2html(block.text, **kwargs)
+def TextPlain2HTML(block, out, **kwargs) -> None:  # noqa
+    out.write(html.escape(block.text).replace("\n", "<br>"))
 
 
-async def TextMarked2HTML(block, **kwargs) -> str:
-    return await block2html(block.text, **kwargs)
+def TextFixed2HTML(block, out, **kwargs) -> None:
+    block2html(block.text, out, **kwargs)
 
 
-async def TextBold2HTML(block, **kwargs) -> str:
-    html_text = await block2html(block.text, **kwargs)
-    return f"<b>{html_text}</b>"
+def TextMarked2HTML(block, out, **kwargs) -> None:
+    block2html(block.text, out, **kwargs)
 
 
-async def TextItalic2HTML(block, **kwargs) -> str:
-    html_text = await block2html(block.text, **kwargs)
-    return f"<i>{html_text}</i>"
+def TextBold2HTML(block, out, **kwargs) -> None:
+    _wrap(block.text, out, "<b>", "</b>", **kwargs)
 
 
-async def TextStrike2HTML(block, **kwargs) -> str:
-    html_text = await block2html(block.text, **kwargs)
-    return f"<del>{html_text}</del>"
+def TextItalic2HTML(block, out, **kwargs) -> None:
+    _wrap(block.text, out, "<i>", "</i>", **kwargs)
 
 
-async def TextUnderline2HTML(block, **kwargs) -> str:
-    html_text = await block2html(block.text, **kwargs)
-    return f"<u>{html_text}</u>"
+def TextStrike2HTML(block, out, **kwargs) -> None:
+    _wrap(block.text, out, "<del>", "</del>", **kwargs)
 
 
-async def TextSubscript2HTML(block, **kwargs) -> str:
-    html_text = await block2html(block.text, **kwargs)
-    return f"<sub>{html_text}</sub>"
+def TextUnderline2HTML(block, out, **kwargs) -> None:
+    _wrap(block.text, out, "<u>", "</u>", **kwargs)
 
 
-async def TextSuperscript2HTML(block, **kwargs) -> str:
-    html_text = await block2html(block.text, **kwargs)
-    return f"<sup>{html_text}</sup>"
+def TextSubscript2HTML(block, out, **kwargs) -> None:
+    _wrap(block.text, out, "<sub>", "</sub>", **kwargs)
 
 
-async def TextAnchor2HTML(block, **kwargs) -> str:
-    html_text = await block2html(block.text, **kwargs)
-    return f'<span id="{block.name}">{html_text}</span>'
+def TextSuperscript2HTML(block, out, **kwargs) -> None:
+    _wrap(block.text, out, "<sup>", "</sup>", **kwargs)
 
 
-async def TextEmail2HTML(block, **kwargs) -> str:
-    html_text = await block2html(block.text, **kwargs)
-    return f'<a href="mailto:{block.email}">{html_text}</a>'
+def TextAnchor2HTML(block, out, **kwargs) -> None:
+    _wrap(block.text, out, f'<span id="{block.name}">', "</span>", **kwargs)
 
 
-async def TextPhone2HTML(block, **kwargs) -> str:
-    html_text = await block2html(block.text, **kwargs)
-    return f'<a href="tel:{block.phone}">{html_text}</a>'
+def TextEmail2HTML(block, out, **kwargs) -> None:
+    _wrap(block.text, out, f'<a href="mailto:{block.email}">', "</a>", **kwargs)
 
 
-async def TextUrl2HTML(block, **kwargs) -> str:
-    html_text = await block2html(block.text, **kwargs)
-    return f'<a href="{block.url}">{html_text}</a>'
+def TextPhone2HTML(block, out, **kwargs) -> None:
+    _wrap(block.text, out, f'<a href="tel:{block.phone}">', "</a>", **kwargs)
 
 
-async def TextConcat2HTML(block, **kwargs) -> str:
-    html_text = ""
-    for text in block.texts:
-        html_text += await block2html(text, **kwargs)
-    return html_text
+def TextUrl2HTML(block, out, **kwargs) -> None:
+    _wrap(block.text, out, f'<a href="{block.url}">', "</a>", **kwargs)
 
 
-async def TextImage2HTML(block, **kwargs) -> str:
-    photo = None
-    for doc in kwargs["msg"].web_preview.cached_page.documents:
-        if doc.id == block.document_id:
-            photo = doc
-            break
-    if photo:
-        img = await _download_image(kwargs["logger"], kwargs["client"], photo)
+def TextConcat2HTML(block, out, **kwargs) -> None:
+    blocks2html(block.texts, out, **kwargs)
+
+
+def TextImage2HTML(block, out, **kwargs) -> None:
+    img = kwargs["images"].get(block.document_id)
+    if img:
+        mime, data = img
         width = str(block.w) if block.w else "100%"
         height = str(block.h) if block.h else "auto"
-        return f'<img src="data:image/png;base64,{img}" style="width:{width}; height: {height};"/>'
-    return ""
+        out.write(
+            f'<img src="data:{mime};base64,{data}" style="width:{width}; height: {height};"/>'
+        )
 
 
-async def PageBlockCover2HTML(block, **kwargs) -> str:
-    return await block2html(block.cover, **kwargs)
+def PageBlockCover2HTML(block, out, **kwargs) -> None:
+    block2html(block.cover, out, **kwargs)
 
 
-async def PageBlockTitle2HTML(block, **kwargs) -> str:
-    html_text = await block2html(block.text, **kwargs)
-    return f"<h1>{html_text}</h1>"
+def PageBlockTitle2HTML(block, out, **kwargs) -> None:
+    _wrap(block.text, out, "<h1>", "</h1>", **kwargs)
 
 
-async def PageBlockSubtitle2HTML(block, **kwargs) -> str:
-    html_text = await block2html(block.text, **kwargs)
-    return f"<h2>{html_text}</h2>"
+def PageBlockSubtitle2HTML(block, out, **kwargs) -> None:
+    _wrap(block.text, out, "<h2>", "</h2>", **kwargs)
 
 
-async def PageBlockHeader2HTML(block, **kwargs) -> str:
-    html_text = await block2html(block.text, **kwargs)
-    return f"<h2>{html_text}</h2>"
+def PageBlockHeader2HTML(block, out, **kwargs) -> None:
+    _wrap(block.text, out, "<h2>", "</h2>", **kwargs)
 
 
-async def PageBlockSubheader2HTML(block, **kwargs) -> str:
-    html_text = await block2html(block.text, **kwargs)
-    return f"<h3>{html_text}</h3>"
+def PageBlockSubheader2HTML(block, out, **kwargs) -> None:
+    _wrap(block.text, out, "<h3>", "</h3>", **kwargs)
 
 
-async def PageBlockParagraph2HTML(block, **kwargs) -> str:
-    html_text = await block2html(block.text, **kwargs)
-    return f"<p>{html_text}</p>"
+def PageBlockParagraph2HTML(block, out, **kwargs) -> None:
+    _wrap(block.text, out, "<p>", "</p>", **kwargs)
 
 
-async def PageBlockPullquote2HTML(block, **kwargs) -> str:
-    html_text = await block2html(block.text, **kwargs)
-    return f"<center>{html_text}</center>"
+def PageBlockPullquote2HTML(block, out, **kwargs) -> None:
+    _wrap(block.text, out, "<center>", "</center>", **kwargs)
 
 
-async def PageBlockBlockquote2HTML(block, **kwargs) -> str:
-    html_text = await block2html(block.text, **kwargs)
-    return f"<blockquote>{html_text}</blockquote>"
+def PageBlockBlockquote2HTML(block, out, **kwargs) -> None:
+    _wrap(block.text, out, "<blockquote>", "</blockquote>", **kwargs)
 
 
-async def PageBlockFooter2HTML(block, **kwargs) -> str:
-    html_text = await block2html(block.text, **kwargs)
-    return f"<footer>{html_text}</footer>"
+def PageBlockFooter2HTML(block, out, **kwargs) -> None:
+    _wrap(block.text, out, "<footer>", "</footer>", **kwargs)
 
 
-async def PageBlockOrderedList2HTML(block, **kwargs) -> str:
-    html_text = await blocks2html(block.items, **kwargs)
-    return f"<ol>{html_text}</ol>"
+def PageBlockOrderedList2HTML(block, out, **kwargs) -> None:
+    out.write("<ol>")
+    blocks2html(block.items, out, **kwargs)
+    out.write("</ol>")
 
 
-async def PageListOrderedItemText2HTML(block, **kwargs) -> str:
-    html_text = await block2html(block.text, **kwargs)
-    return f"<li>{html_text}</li>"
+def PageListOrderedItemText2HTML(block, out, **kwargs) -> None:
+    _wrap(block.text, out, "<li>", "</li>", **kwargs)
 
 
-async def PageListOrderedItemBlocks2HTML(block, **kwargs) -> str:
-    html_text = await blocks2html(block.blocks, **kwargs)
-    return f"<li>{html_text}</li>"
+def PageListOrderedItemBlocks2HTML(block, out, **kwargs) -> None:
+    out.write("<li>")
+    blocks2html(block.blocks, out, **kwargs)
+    out.write("</li>")
 
 
-async def PageBlockList2HTML(block, **kwargs) -> str:
-    html_text = await blocks2html(block.items, **kwargs)
-    return f"<ul>{html_text}</ul>"
+def PageBlockList2HTML(block, out, **kwargs) -> None:
+    out.write("<ul>")
+    blocks2html(block.items, out, **kwargs)
+    out.write("</ul>")
 
 
-async def PageListItemText2HTML(block, **kwargs) -> str:
-    html_text = await block2html(block.text, **kwargs)
-    return f"<li>{html_text}</li>"
+def PageListItemText2HTML(block, out, **kwargs) -> None:
+    _wrap(block.text, out, "<li>", "</li>", **kwargs)
 
 
-async def PageListItemBlocks2HTML(block, **kwargs) -> str:
-    html_text = await blocks2html(block.blocks, **kwargs)
-    return f"<li>{html_text}</li>"
+def PageListItemBlocks2HTML(block, out, **kwargs) -> None:
+    out.write("<li>")
+    blocks2html(block.blocks, out, **kwargs)
+    out.write("</li>")
 
 
-async def PageBlockPreformatted2HTML(block, **kwargs) -> str:
-    return await block2html(block.text, **kwargs)
+def PageBlockPreformatted2HTML(block, out, **kwargs) -> None:
+    block2html(block.text, out, **kwargs)
 
 
-async def PageBlockKicker2HTML(block, **kwargs) -> str:
-    return await block2html(block.text, **kwargs)
+def PageBlockKicker2HTML(block, out, **kwargs) -> None:
+    block2html(block.text, out, **kwargs)
 
 
-async def PageBlockDivider2HTML(block, **kwargs) -> str:  # noqa
-    return "<hr>"
+def PageBlockDivider2HTML(block, out, **kwargs) -> None:  # noqa
+    out.write("<hr>")
 
 
-async def PageBlockAnchor2HTML(block, **kwargs) -> str:  # noqa
-    return f'<span id="{block.name}"></span>'
+def PageBlockAnchor2HTML(block, out, **kwargs) -> None:  # noqa
+    out.write(f'<span id="{block.name}"></span>')
 
 
-async def PageBlockDetails2HTML(block, **kwargs) -> str:
-    title = await block2html(block.title, **kwargs)
-    html_text = await blocks2html(block.blocks, **kwargs)
-    return f"<details><summary>{title}</summary>{html_text}</details>"
+def PageBlockDetails2HTML(block, out, **kwargs) -> None:
+    _wrap(block.title, out, "<details><summary>", "</summary>", **kwargs)
+    blocks2html(block.blocks, out, **kwargs)
+    out.write("</details>")
 
 
-async def PageBlockTable2HTML(block, **kwargs) -> str:
-    title = await block2html(block.title, **kwargs)
-    html_text = await blocks2html(block.rows, **kwargs)
+def PageBlockTable2HTML(block, out, **kwargs) -> None:
     border = 'border="1"' if block.bordered else ""
-    return f"<table {border}><caption>{title}</caption>{html_text}</table>"
+    _wrap(block.title, out, f"<table {border}><caption>", "</caption>", **kwargs)
+    blocks2html(block.rows, out, **kwargs)
+    out.write("</table>")
 
 
-async def PageTableRow2HTML(block, **kwargs) -> str:
-    html_text = await blocks2html(block.cells, **kwargs)
-    return f"<tr>{html_text}</tr>"
+def PageTableRow2HTML(block, out, **kwargs) -> None:
+    out.write("<tr>")
+    blocks2html(block.cells, out, **kwargs)
+    out.write("</tr>")
 
 
-async def PageTableCell2HTML(block, **kwargs) -> str:
-    text = await block2html(block.text, **kwargs)
+def PageTableCell2HTML(block, out, **kwargs) -> None:
     tag = "th" if block.header else "td"
     style = ""
     if block.align_center:
@@ -247,17 +431,20 @@ async def PageTableCell2HTML(block, **kwargs) -> str:
         style += "vertical-align:middle;"
     elif block.valign_bottom:
         style += "vertical-align:bottom;"
-    return f'<{tag} style="{style}" colspan="{block.colspan}" rowspan="{block.rowspan}">{text}</{tag}>'
+    start = (
+        f'<{tag} style="{style}" colspan="{block.colspan}" rowspan="{block.rowspan}">'
+    )
+    _wrap(block.text, out, start, f"</{tag}>", **kwargs)
 
 
-async def PageBlockEmbedPost2HTML(block, **kwargs) -> str:
-    return await blocks2html(block.blocks, **kwargs)
+def PageBlockEmbedPost2HTML(block, out, **kwargs) -> None:
+    blocks2html(block.blocks, out, **kwargs)
 
 
-async def PageBlockEmbed2HTML(block, **kwargs) -> str:  # noqa
+def PageBlockEmbed2HTML(block, out, **kwargs) -> None:  # noqa
     src = f'src="{block.url}"' if block.url else ""
     srcdoc = f'srcdoc="{html.escape(block.html)}"' if block.html else ""
-    title = await block2html(block.caption, **kwargs)
+    title = _render(block.caption, **kwargs)
     style = ""
     if block.full_width:
         style += "width:100%;"
@@ -265,45 +452,39 @@ async def PageBlockEmbed2HTML(block, **kwargs) -> str:  # noqa
         style += f"width:{block.w};"
     if block.h:
         style += f"height:{block.h};"
-    return f'<iframe {src} {srcdoc} title="{title}" style="{style}"></iframe>'
+    out.write(f'<iframe {src} {srcdoc} title="{title}" style="{style}"></iframe>')
 
 
-async def PageBlockAuthorDate2HTML(block, **kwargs) -> str:
-    author = await block2html(block.author, **kwargs)
+def PageBlockAuthorDate2HTML(block, out, **kwargs) -> None:
+    author = _render(block.author, **kwargs)
     date = block.published_date.strftime("%d/%m/%Y") if block.published_date else ""
     html_text = " - ".join(text for text in [date, author] if text)
-    return f"<small>{html_text}</small>" if html_text else ""
+    if html_text:
+        out.write(f"<small>{html_text}</small>")
 
 
-async def PageCaption2HTML(block, **kwargs) -> str:
-    text = await block2html(block.text, **kwargs)
-    credit = await block2html(block.credit, **kwargs)
+def PageCaption2HTML(block, out, **kwargs) -> None:
+    text = _render(block.text, **kwargs)
+    credit = _render(block.credit, **kwargs)
     html_text = " - ".join(text for text in [text, credit] if text)
-    return f"<small>{html_text}</small>" if html_text else ""
-
-
-async def PageBlockPhoto2HTML(block, **kwargs) -> str:
-    msg = kwargs["msg"]
-    photo = None
-    try:
-        if msg.web_preview.photo.id == block.photo_id:
-            photo = msg.web_preview.photo
-    except AttributeError:
-        pass
-    if not photo:
-        try:
-            if msg.media.webpage.photo.id == block.photo_id:
-                photo = msg.media.webpage.photo
-        except AttributeError:
-            pass
-    if not photo:
-        for pic in msg.web_preview.cached_page.photos:
-            if pic.id == block.photo_id:
-                photo = pic
-                break
-    if photo:
-        img = await _download_image(kwargs["logger"], kwargs["client"], photo)
-        html_text = f'<center><img src="data:image/png;base64,{img}" alt="COVER" style="width:100%"/></center>'
-        html_text += await block2html(block.caption, **kwargs)
-        return html_text
-    return ""
+    if html_text:
+        out.write(f"<small>{html_text}</small>")
+
+
+def PageBlockPhoto2HTML(block, out, **kwargs) -> None:
+    img = kwargs["images"].get(block.photo_id)
+    if img:
+        mime, data = img
+        out.write(
+            f'<center><img src="data:{mime};base64,{data}" alt="COVER" style="width:100%"/></center>'
+        )
+    # images left out, e.g. over the page budget, keep their caption
+    block2html(block.caption, out, **kwargs)
+
+
+# handlers of the supported types, resolved once instead of for every block
+_HANDLERS = {
+    getattr(types, name[: -len("2HTML")]): func
+    for name, func in list(globals().items())
+    if name.endswith("2HTML")
+}
@@ -0,0 +1,129 @@
+"""Runtime metrics of the bridge."""
+
+import os
+import time
+from threading import Lock
+from typing import Dict, List, Tuple
+
+_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, float("inf"))
+_PREFIX = "tgchan_"
+_lock = Lock()
+_start = time.time()
+_counters: Dict[str, float] = {}
+_histograms: Dict[str, "Histogram"] = {}
+_channels: Dict[int, float] = {}
+
+DESCRIPTIONS = {
+    "messages_fetched": "Messages fetched from Telegram",
+    "messages_delivered": "Messages sent to Delta Chat",
+    "delivery_errors": "Failed attempts to send a message to Delta Chat",
+    "bytes_downloaded": "Bytes of media downloaded from Telegram",
+    "flood_wait_seconds": "Seconds Telegram asked to wait before retrying requests",
+    "channel_check_seconds": "Time taken to check a channel for new messages",
+    "page_render_seconds": "Time taken to render an Instant View page",
+    "sweep_seconds": "Time taken to check all the due channels",
+    "outbox_size": "Messages waiting to be sent to Delta Chat",
+    "quarantined_channels": "Channels that failed too many times in a row",
+}
+
+
+class Histogram:  # pylint: disable=R0903
+    """Distribution of observed durations, in Prometheus' cumulative buckets."""
+
+    def __init__(self) -> None:
+        self.buckets = [0] * len(_BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        for index, bound in enumerate(_BUCKETS):
+            if value <= bound:
+                self.buckets[index] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+
+def inc(name: str, value: float = 1) -> None:
+    """Increase the counter with the given name."""
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def observe(name: str, seconds: float) -> None:
+    """Add a duration to the histogram with the given name."""
+    with _lock:
+        histogram = _histograms.get(name)
+        if histogram is None:
+            histogram = _histograms[name] = Histogram()
+        histogram.observe(seconds)
+
+
+def observe_channel(chan_id: int, seconds: float) -> None:
+    """Record how long checking the given channel took."""
+    observe("channel_check_seconds", seconds)
+    with _lock:
+        _channels[chan_id] = seconds
+
+
+def forget_channel(chan_id: int) -> None:
+    with _lock:
+        _channels.pop(chan_id, None)
+
+
+def get_slowest_channels(count: int = 5) -> List[Tuple[int, float]]:
+    """Get the channels that took the longest to check the last time."""
+    with _lock:
+        channels = sorted(_channels.items(), key=lambda item: item[1], reverse=True)
+    return channels[:count]
+
+
+def get_report(gauges: Dict[str, float]) -> str:
+    """Get a human readable report of the metrics and the given gauges."""
+    lines = [f"Uptime: {int(time.time() - _start)} seconds"]
+    with _lock:
+        for name, value in sorted({**_counters, **gauges}.items()):
+            lines.append(f"{DESCRIPTIONS.get(name, name)}: {_format(value)}")
+        for name, hist in sorted(_histograms.items()):
+            avg = hist.sum / hist.count if hist.count else 0
+            lines.append(
+                f"{DESCRIPTIONS.get(name, name)}: count={hist.count}"
+                f" avg={avg:.3f}s max={hist.max:.3f}s"
+            )
+    return "\n".join(lines)
+
+
+def to_prometheus(gauges: Dict[str, float]) -> str:
+    """Get the metrics and the given gauges in Prometheus' text format."""
+    lines = []
+    with _lock:
+        for kind, values in (("counter", _counters), ("gauge", gauges)):
+            for name, value in sorted(values.items()):
+                name, desc = _PREFIX + name, DESCRIPTIONS.get(name, name)
+                lines += [f"# HELP {name} {desc}", f"# TYPE {name} {kind}"]
+                lines.append(f"{name} {_format(value)}")
+        for name, hist in sorted(_histograms.items()):
+            name, desc = _PREFIX + name, DESCRIPTIONS.get(name, name)
+            lines += [f"# HELP {name} {desc}", f"# TYPE {name} histogram"]
+            for bound, count in zip(_BUCKETS, hist.buckets):
+                bound_text = "+Inf" if bound == float("inf") else f"{bound:g}"
+                lines.append(f'{name}_bucket{{le="{bound_text}"}} {count}')
+            lines.append(f"{name}_sum {hist.sum}")
+            lines.append(f"{name}_count {hist.count}")
+    return "\n".join(lines) + "\n"
+
+
+def _format(value: float) -> str:
+    return str(int(value)) if value == int(value) else str(value)
+
+
+def dump(path: str, gauges: Dict[str, float]) -> None:
+    """Write the metrics to the given file in Prometheus' text format.
+
+    The file is replaced atomically, so it can be read by node exporter's
+    textfile collector at any moment.
+    """
+    with open(f"{path}.tmp", "w", encoding="utf-8") as file:
+        file.write(to_prometheus(gauges))
+    os.replace(f"{path}.tmp", path)
@@ -1,9 +1,20 @@
 from contextlib import contextmanager
-from threading import Lock
 
-from sqlalchemy import Column, ForeignKey, Integer, String, create_engine
+from sqlalchemy import (
+    Column,
+    Float,
+    ForeignKey,
+    Integer,
+    String,
+    Text,
+    create_engine,
+    event,
+    inspect,
+    text,
+)
 from sqlalchemy.ext.declarative import declarative_base, declared_attr
 from sqlalchemy.orm import relationship, sessionmaker
+from sqlalchemy.pool import QueuePool
 
 
 class Base:
@@ -14,13 +25,20 @@ class Base:
 
 Base = declarative_base(cls=Base)
 _Session = sessionmaker()
-_lock = Lock()
 
 
 class Channel(Base):
     id = Column(Integer, primary_key=True)
     title = Column(String(1000))
     last_msg = Column(Integer)
+    last_post = Column(Integer)  # timestamp of the newest post seen
+    post_interval = Column(Float)  # average seconds between posts
+    access_hash = Column(Integer)
+    pts = Column(Integer)  # channel update state
+    session = Column(Integer, nullable=False, default=0, server_default="0")
+    # consecutive failed checks, the channel is quarantined after max_failures
+    failures = Column(Integer, nullable=False, default=0, server_default="0")
+    retry_at = Column(Float)  # when a failing channel can be checked again
 
     subscriptions = relationship(
         "Subscription", backref="channel", cascade="all, delete, delete-orphan"
@@ -29,27 +47,113 @@ class Channel(Base):
 
 class Subscription(Base):
     chat_id = Column(Integer, primary_key=True)
-    chan_id = Column(Integer, ForeignKey("channel.id"), primary_key=True)
+    # the primary key is useless to look up the subscriptions of a channel
+    chan_id = Column(Integer, ForeignKey("channel.id"), primary_key=True, index=True)
     filter = Column(String(1000))
+    digest = Column(Integer)  # seconds between digests, None to get posts right away
+    digest_at = Column(Float)  # when the next digest is due
+
+
+class UpdateState(Base):
+    """Telegram's common update state of a session, the ID is the session index.
+
+    The channels' state is kept in Channel.pts.
+    """
+
+    id = Column(Integer, primary_key=True)
+    pts = Column(Integer)
+    qts = Column(Integer)
+    date = Column(Integer)
+    seq = Column(Integer)
+
+
+class Outbox(Base):
+    """A message waiting to be delivered to a Delta Chat chat."""
+
+    id = Column(Integer, primary_key=True)
+    chat_id = Column(Integer, nullable=False, index=True)
+    text = Column(Text)
+    sender = Column(String(1000))
+    filename = Column(String(1000))
+    viewtype = Column(String(50))
+    html = Column(String(1000))  # path of the file with the HTML part
+    spool = Column(String(1000), index=True)  # directory of the message's files
+    attempts = Column(Integer, nullable=False, default=0, server_default="0")
+    retry_at = Column(Float, nullable=False, default=0, server_default="0")
+
+
+class DigestPost(Base):
+    """A post rendered as part of a digest, waiting for the digests of some chats."""
+
+    id = Column(Integer, primary_key=True)
+    chan_id = Column(Integer, nullable=False)
+    html = Column(Text, nullable=False)
+    spool = Column(String(1000))  # directory with the post's images
+
+    entries = relationship(
+        "DigestEntry", backref="post", cascade="all, delete, delete-orphan"
+    )
+
+
+class DigestEntry(Base):
+    """A post waiting for the next digest of a chat."""
+
+    chat_id = Column(Integer, primary_key=True)
+    post_id = Column(Integer, ForeignKey("digestpost.id"), primary_key=True)
 
 
 @contextmanager
 def session_scope():
     """Provide a transactional scope around a series of operations."""
-    with _lock:
-        session = _Session()
-        try:
-            yield session
-            session.commit()
-        except:
-            session.rollback()
-            raise
-        finally:
-            session.close()
+    session = _Session()
+    try:
+        yield session
+        session.commit()
+    except:
+        session.rollback()
+        raise
+    finally:
+        session.close()
 
 
 def init(path: str, debug: bool = False) -> None:
     """Initialize engine."""
-    engine = create_engine(path, echo=debug)
+    engine = create_engine(
+        path,
+        echo=debug,
+        poolclass=QueuePool,
+        pool_size=5,
+        # wait up to 30 seconds for other connections to release the database
+        connect_args={"check_same_thread": False, "timeout": 30},
+    )
+    event.listen(engine, "connect", _on_connect)
     Base.metadata.create_all(engine)
+    _migrate(engine)
     _Session.configure(bind=engine)
+
+
+def _on_connect(dbapi_connection, _connection_record) -> None:
+    """Enable WAL mode so readers don't block on the writer."""
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.close()
+
+
+def _migrate(engine) -> None:
+    """Add the columns and indexes missing in tables created by older versions of the plugin."""
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            columns = {col["name"] for col in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in columns:
+                    coltype = column.type.compile(engine.dialect)
+                    sql = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {coltype}"
+                    if column.server_default is not None:
+                        sql += f" DEFAULT {column.server_default.arg}"
+                        if not column.nullable:
+                            sql += " NOT NULL"
+                    conn.execute(text(sql))
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
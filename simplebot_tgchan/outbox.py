@@ -0,0 +1,210 @@
+"""Persistent queue of the messages to deliver to Delta Chat.
+
+Posts fetched from Telegram are stored in the outbox in the same transaction
+that advances the channel's ``last_msg``. Delivery workers drain it at their
+own pace, so slow sends never stall polling and nothing is lost on errors or
+restarts.
+"""
+
+import os
+import shutil
+import time
+from tempfile import mkdtemp
+from threading import Event, Thread
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from simplebot import DeltaBot
+from simplebot.bot import Replies
+from sqlalchemy import func
+
+from .metrics import inc
+from .orm import DigestPost, Outbox, session_scope
+
+_BATCH_SIZE = 20
+_MAX_ATTEMPTS = 10
+_IDLE_TIMEOUT = 10
+_spool: Optional[str] = None
+_events: List[Event] = []
+
+
+def start_delivery(bot: DeltaBot, spool: str, workers: int = 1) -> None:
+    """Start the delivery workers.
+
+    ``spool`` is the directory where the attachments of queued messages are kept.
+    With no workers, messages are only sent calling :func:`deliver`.
+    """
+    global _spool  # noqa
+    _spool = spool
+    if not os.path.exists(spool):
+        os.makedirs(spool)
+    _clean_spool(spool)
+    for worker in range(workers):
+        event = Event()
+        _events.append(event)
+        Thread(
+            target=_deliver_loop, args=(bot, event, worker, workers), daemon=True
+        ).start()
+
+
+def make_spool_dir() -> str:
+    """Create a directory to store the files of a message to be queued."""
+    assert _spool, "outbox not started"
+    return mkdtemp(dir=_spool)
+
+
+def enqueue(session, chats: Iterable[int], args: dict) -> None:
+    """Queue a message for the given chats as part of the given transaction.
+
+    ``args`` are the ``text``, ``sender``, ``filename``, ``viewtype`` and ``html``
+    of the message, the latter being the path of a file with the HTML, and the
+    ``spool`` directory holding the message's files, removed after delivery.
+    """
+    for chat_id in chats:
+        session.add(Outbox(chat_id=chat_id, **args))
+
+
+def discard_chat(session, chat_id: int) -> List[str]:
+    """Forget the queued messages of a chat the bot can't send to anymore.
+
+    Returns the spool directories to remove once the transaction is committed.
+    """
+    query = session.query(Outbox).filter_by(chat_id=chat_id)
+    spools = {row.spool for row in query}
+    query.delete()
+    return _get_unused(session, spools)
+
+
+def notify_workers() -> None:
+    """Tell the workers there are new messages, call it after committing them."""
+    for event in _events:
+        event.set()
+
+
+def _deliver_loop(bot: DeltaBot, event: Event, worker: int, workers: int) -> None:
+    while True:
+        event.clear()
+        try:
+            if deliver(bot, worker, workers):
+                continue
+        except Exception as ex:
+            bot.logger.exception(ex)
+        event.wait(_IDLE_TIMEOUT)
+
+
+def deliver(bot: DeltaBot, worker: int = 0, workers: int = 1) -> int:
+    """Send the due messages of the chats assigned to the given worker.
+
+    The messages of each chat are sent in order, a failed message is retried
+    with exponential backoff holding back the next messages of its chat.
+    Returns the number of messages sent.
+
+    Delta Chat copies attachments to its blob directory unless they are already
+    there, so once a message is sent the copy is used for the other chats.
+    """
+    now = time.time()
+    with session_scope() as session:
+        heads = session.query(Outbox.chat_id, func.min(Outbox.id).label("id")).group_by(
+            Outbox.chat_id
+        )
+        if workers > 1:
+            heads = heads.filter(Outbox.chat_id % workers == worker)
+        heads = heads.subquery()
+        chats = [
+            chat_id
+            for (chat_id,) in session.query(Outbox.chat_id)
+            .join(heads, Outbox.id == heads.c.id)
+            .filter(Outbox.retry_at <= now)
+        ]
+
+    sent = 0
+    for chat_id in chats:
+        with session_scope() as session:
+            query = session.query(Outbox).filter_by(chat_id=chat_id)
+            batch = [
+                (row.id, row.attempts, row.spool, _get_args(row))
+                for row in query.order_by(Outbox.id).limit(_BATCH_SIZE)
+            ]
+        done: List[int] = []
+        blobs: Dict[Tuple[str, str], str] = {}
+        failed: Optional[int] = None
+        for row_id, attempts, spool, args in batch:
+            try:
+                replies = Replies(bot, bot.logger)
+                replies.add(**args, chat=bot.get_chat(chat_id))
+                msgs = replies.send_reply_messages()
+                done.append(row_id)
+                inc("messages_delivered")
+                if args.get("filename") and msgs and msgs[0].filename:
+                    if msgs[0].filename != args["filename"]:
+                        blobs[(spool, args["filename"])] = msgs[0].filename
+            except Exception as ex:
+                bot.logger.exception(ex)
+                inc("delivery_errors")
+                if attempts + 1 >= _MAX_ATTEMPTS:
+                    bot.logger.warning(f"Dropping message for chat {chat_id}")
+                    done.append(row_id)
+                else:
+                    failed = row_id
+                break
+        sent += len(done)
+        with session_scope() as session:
+            spools = set()
+            for row in session.query(Outbox).filter(Outbox.id.in_(done)):
+                spools.add(row.spool)
+                session.delete(row)
+            for (spool, filename), blob in blobs.items():
+                query = session.query(Outbox).filter_by(spool=spool, filename=filename)
+                query.update({"filename": blob}, synchronize_session=False)
+            if failed:
+                query = session.query(Outbox).filter_by(id=failed)
+                query.update(
+                    {Outbox.attempts: Outbox.attempts + 1}, synchronize_session=False
+                )
+                row = query.first()
+                if row:
+                    row.retry_at = now + min(5 * 2**row.attempts, 60 * 60)
+            unused = _get_unused(session, spools)
+        remove_spools(unused)
+    return sent
+
+
+def remove_spools(spools: Iterable[Optional[str]]) -> None:
+    for spool in spools:
+        if spool:
+            shutil.rmtree(spool, ignore_errors=True)
+
+
+def _get_unused(session, spools: Iterable[Optional[str]]) -> List[str]:
+    """Get the given spool directories no queued message uses anymore."""
+    session.flush()
+    return [
+        spool
+        for spool in spools
+        if spool and not session.query(Outbox.id).filter_by(spool=spool).first()
+    ]
+
+
+def _get_args(row: Outbox) -> dict:
+    args = dict(text=row.text, sender=row.sender)
+    if row.filename:
+        args["filename"] = row.filename
+        args["viewtype"] = row.viewtype
+    if row.html and os.path.exists(row.html):
+        with open(row.html, encoding="utf-8") as file:
+            args["html"] = file.read()
+    return args
+
+
+def _clean_spool(spool: str) -> None:
+    """Remove the files of messages that were never queued, due to a crash.
+
+    The images of the posts waiting for a digest are kept.
+    """
+    with session_scope() as session:
+        queued = {path for (path,) in session.query(Outbox.spool).distinct()}
+        queued.update(path for (path,) in session.query(DigestPost.spool).distinct())
+    remove_spools(
+        path
+        for path in (os.path.join(spool, name) for name in os.listdir(spool))
+        if path not in queued
+    )
@@ -0,0 +1,92 @@
+"""Rate limiting of the requests sent to Telegram."""
+
+import asyncio
+import math
+import time
+from typing import Dict
+
+from telethon.errors import FloodWaitError
+
+from .metrics import inc
+
+
+class _Bucket:
+    """Token bucket with additive increase/multiplicative decrease of its rate."""
+
+    def __init__(self, rate: float, min_rate: float) -> None:
+        self.max_rate = rate
+        self.min_rate = min_rate
+        self.rate = rate
+        self.tokens = 1.0
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    async def acquire(self, deadline: float = None) -> None:
+        while True:
+            now = time.monotonic()
+            if self.paused_until > now:
+                if deadline is not None and self.paused_until > deadline:
+                    raise FloodWaitError(
+                        None, capture=math.ceil(self.paused_until - now)
+                    )
+                await asyncio.sleep(self.paused_until - now)
+                continue
+            self.tokens = min(
+                self.tokens + (now - self.updated) * self.rate, max(self.rate, 1.0)
+            )
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def on_success(self) -> None:
+        self.rate = min(self.rate + self.min_rate, self.max_rate)
+
+    def on_flood_wait(self, seconds: int) -> None:
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.rate = max(self.rate / 2, self.min_rate)
+        self.tokens = 0.0
+
+
+class RateLimiter:  # pylint: disable=R0903
+    """Limit the rate of requests to Telegram, adapting to flood waits.
+
+    Requests are grouped in classes (ex. "history", "download"), each class has
+    its own bucket so a flood wait only pauses and slows down the requests of
+    the affected class, the request that got the flood wait is retried once the
+    wait is over.
+    """
+
+    def __init__(self, rate: float, min_rate: float = 0.05, logger=None) -> None:
+        self.rate = rate
+        self.min_rate = min_rate
+        self.logger = logger
+        self._buckets: Dict[str, _Bucket] = {}
+
+    async def call(self, key: str, func, *args, max_wait: float = None, **kwargs):
+        """Await ``func(*args, **kwargs)`` when the ``key`` request class allows it.
+
+        Flood waits are waited out and the request retried, unless waiting would
+        take more than ``max_wait`` seconds, then the FloodWaitError is raised.
+        """
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = _Bucket(self.rate, self.min_rate)
+        deadline = None if max_wait is None else time.monotonic() + max_wait
+        while True:
+            await bucket.acquire(deadline)
+            try:
+                result = await func(*args, **kwargs)
+            except FloodWaitError as ex:
+                if self.logger:
+                    self.logger.warning(
+                        f"Flood wait of {ex.seconds} seconds for {key!r} requests"
+                    )
+                bucket.on_flood_wait(ex.seconds)
+                inc("flood_wait_seconds", ex.seconds)
+                if deadline is not None and bucket.paused_until > deadline:
+                    raise
+                continue
+            bucket.on_success()
+            return result
@@ -0,0 +1,71 @@
+"""In-memory routing of channel posts to the subscribed chats."""
+
+from threading import Lock
+from typing import Dict, Iterable, Optional, Tuple
+
+from .filters import Matcher
+
+_NO_ROUTE = Matcher(())
+
+
+class RoutingTable:
+    """The compiled subscriptions of each channel and their digest intervals.
+
+    It is loaded from the database on start and then updated along with it,
+    so fanning a post out is a dictionary lookup instead of a query.
+    """
+
+    def __init__(self) -> None:
+        self._routes: Dict[int, Matcher] = {}
+        self._digests: Dict[int, Dict[int, int]] = {}
+        self._lock = Lock()
+
+    def load(
+        self, subscriptions: Dict[int, Iterable[Tuple[int, str, Optional[int]]]]
+    ) -> None:
+        """Replace all the routes with the ``(chat ID, filter, digest)`` of each channel."""
+        routes, digests = {}, {}
+        for chan_id, subs in subscriptions.items():
+            subs = list(subs)
+            routes[chan_id] = Matcher(
+                (chat_id, filter_) for chat_id, filter_, _ in subs
+            )
+            digests[chan_id] = {
+                chat_id: digest for chat_id, _, digest in subs if digest
+            }
+        with self._lock:
+            self._routes, self._digests = routes, digests
+
+    def get(self, chan_id: int) -> Matcher:
+        """Get the compiled subscriptions of the given channel."""
+        return self._routes.get(chan_id, _NO_ROUTE)
+
+    def get_digests(self, chan_id: int) -> Dict[int, int]:
+        """Get the digest interval of the chats that get the channel's posts in digests."""
+        return self._digests.get(chan_id, {})
+
+    def add(self, chan_id: int, chat_id: int, filter_: str, digest: int = None) -> None:
+        """Subscribe a chat to a channel."""
+        with self._lock:
+            subs = self.get(chan_id).subscriptions
+            subs = tuple(sub for sub in subs if sub[0] != chat_id)
+            self._routes[chan_id] = Matcher(subs + ((chat_id, filter_),))
+            digests = dict(self.get_digests(chan_id))
+            digests.pop(chat_id, None)
+            if digest:
+                digests[chat_id] = digest
+            self._digests[chan_id] = digests
+
+    def remove(self, chan_id: int, chat_id: int) -> None:
+        """Unsubscribe a chat from a channel."""
+        with self._lock:
+            subs = self.get(chan_id).subscriptions
+            subs = tuple(sub for sub in subs if sub[0] != chat_id)
+            digests = dict(self.get_digests(chan_id))
+            digests.pop(chat_id, None)
+            if subs:
+                self._routes[chan_id] = Matcher(subs)
+                self._digests[chan_id] = digests
+            else:
+                self._routes.pop(chan_id, None)
+                self._digests.pop(chan_id, None)
@@ -0,0 +1,92 @@
+"""Per-channel polling schedule based on the channels' activity."""
+
+import heapq
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+# weight of the newest interval in the moving average of intervals between posts
+_SMOOTHING = 0.3
+
+
+class Delays(NamedTuple):
+    """Bounds of the interval between checks of a channel, in seconds."""
+
+    default: float  # used until the activity of a channel is known
+    min_delay: float
+    max_delay: float
+
+
+class Scheduler:
+    """Priority queue of channels ordered by the time they should be checked next."""
+
+    def __init__(self) -> None:
+        self._heap: List[Tuple[float, int]] = []
+        self._due: Dict[int, float] = {}
+
+    def __len__(self) -> int:
+        return len(self._due)
+
+    def schedule(self, chan_id: int, due: float) -> None:
+        self._due[chan_id] = due
+        heapq.heappush(self._heap, (due, chan_id))
+
+    def sync(self, channels: Dict[int, float]) -> None:
+        """Schedule the new ``{channel ID: due}`` channels and forget the removed ones."""
+        for chan_id in channels.keys() - self._due.keys():
+            self.schedule(chan_id, channels[chan_id])
+        for chan_id in self._due.keys() - channels.keys():
+            del self._due[chan_id]
+
+    def pop_due(self, now: float) -> List[int]:
+        """Remove and return the channels that should be checked by ``now``."""
+        chan_ids = []
+        while self._heap and self._heap[0][0] <= now:
+            due, chan_id = heapq.heappop(self._heap)
+            if self._due.get(chan_id) == due:  # skip outdated entries
+                del self._due[chan_id]
+                chan_ids.append(chan_id)
+        return chan_ids
+
+    def next_due(self) -> Optional[float]:
+        """Return the time the next channel is due, or None if nothing is scheduled."""
+        while self._heap:
+            due, chan_id = self._heap[0]
+            if self._due.get(chan_id) == due:
+                return due
+            heapq.heappop(self._heap)
+        return None
+
+
+def update_activity(
+    last_post: Optional[int], post_interval: Optional[float], post_date: int
+) -> Tuple[int, Optional[float]]:
+    """Account a new post, return the updated ``(last_post, post_interval)``."""
+    if last_post is None:
+        return post_date, post_interval
+    if post_date <= last_post:
+        return last_post, post_interval
+    interval: float = post_date - last_post
+    if post_interval is not None:
+        interval = post_interval * (1 - _SMOOTHING) + interval * _SMOOTHING
+    return post_date, interval
+
+
+def retry_delay(failures: int, delay: float, max_delay: float) -> float:
+    """Return how many seconds to wait before checking again a channel that failed
+    ``failures`` times in a row, the wait doubles with every failure.
+    """
+    return min(delay * 2 ** (failures - 1), max_delay)
+
+
+def next_interval(
+    last_post: Optional[int], post_interval: Optional[float], now: float, delays: Delays
+) -> float:
+    """Return how many seconds to wait before checking a channel again.
+
+    Channels are checked twice per expected interval between posts, the
+    longer a channel stays silent the less often it is checked.
+    """
+    if last_post is None or post_interval is None:
+        interval = delays.default
+    else:
+        interval = max(post_interval, now - last_post) / 2
+    return min(max(interval, delays.min_delay), delays.max_delay)
@@ -2,20 +2,23 @@
 
 from simplebot import DeltaBot
 
-from .util import get_client, set_config, sync
+from .util import add_session, get_client, sync
 
 
 # pylama:ignore=C0103
 class login:
-    """Login on Telegram."""
+    """Login on Telegram.
+
+    Every login adds a new session, channels are spread among all the sessions.
+    """
 
     def add_arguments(self, parser) -> None:
-        parser.add_argument("--session", help="set a saved session")
+        parser.add_argument("--session", help="add a saved session")
 
     def run(self, bot: DeltaBot, args, out) -> None:
         if args.session:
-            set_config(bot, "session", args.session)
-            out.line("Session set")
+            add_session(bot, args.session)
+            out.line("Session added")
         else:
             self._login(bot, out)
 
@@ -33,7 +36,7 @@ class login:
             code = input("Please enter the code you received: ")
             await client.sign_in(phone, code, phone_code_hash=phone_code_hash)
             session = client.session.save()
-            set_config(bot, "session", session)
+            add_session(bot, session)
             out.line("You have logged in successfully. Your session is:")
             out.line(session)
         except Exception as ex:
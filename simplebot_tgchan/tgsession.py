@@ -0,0 +1,160 @@
+"""Telethon session backed by the plugin's database."""
+
+from datetime import datetime, timezone
+from threading import Lock
+
+from telethon import utils
+from telethon.sessions import StringSession
+from telethon.tl.types import Channel as TLChannel
+from telethon.tl.types import PeerChannel
+from telethon.tl.types.updates import State
+
+from .orm import Channel, UpdateState, session_scope
+
+
+class DBSession(StringSession):
+    """String session that persists the update state in the plugin's database.
+
+    ``index`` is the position of the session in the session list, only the
+    channels assigned to that session are handled.
+
+    With the update state and the access hashes of the subscribed channels
+    saved, Telegram can be asked for just the updates missed while offline
+    (updates.getDifference and updates.getChannelDifference) when the client
+    connects again.
+
+    Telethon hands the state over from the event loop, so it is only buffered
+    in memory and written to the database by ``flush()``.
+    """
+
+    def __init__(self, string: str = None, index: int = 0) -> None:
+        super().__init__(string)
+        self.index = index
+        self._lock = Lock()
+        self._states: dict = {}
+        self._changed_hashes: dict = {}
+        with session_scope() as session:
+            self._hashes = {
+                chan.id: chan.access_hash
+                for chan in session.query(Channel).filter_by(session=index)
+            }
+
+    def get_update_state(self, entity_id: int):
+        with self._lock:
+            state = self._states.get(entity_id)
+        if state:
+            return state
+        with session_scope() as session:
+            if entity_id == 0:
+                state = session.query(UpdateState).filter_by(id=self.index).first()
+                if state:
+                    date = datetime.fromtimestamp(state.date, tz=timezone.utc)
+                    return State(state.pts, state.qts, date, state.seq, 0)
+            else:
+                chan = (
+                    session.query(Channel)
+                    .filter_by(id=entity_id, session=self.index)
+                    .first()
+                )
+                if chan and chan.pts:
+                    return State(chan.pts, 0, datetime.now(tz=timezone.utc), 0, 0)
+        return None
+
+    def set_update_state(self, entity_id: int, state) -> None:
+        # only the state of subscribed channels is kept
+        if entity_id == 0 or entity_id in self._hashes:
+            with self._lock:
+                self._states[entity_id] = state
+
+    def get_update_states(self) -> list:
+        states = {}
+        state = self.get_update_state(0)
+        if state:
+            states[0] = state
+        now = datetime.now(tz=timezone.utc)
+        with session_scope() as session:
+            query = session.query(Channel).filter_by(session=self.index)
+            for chan in query.filter(Channel.pts.isnot(None)):
+                states[chan.id] = State(chan.pts, 0, now, 0, 0)
+        with self._lock:
+            states.update(self._states)
+        return list(states.items())
+
+    def process_entities(self, tlo) -> None:
+        super().process_entities(tlo)
+        entities = tlo if isinstance(tlo, list) else getattr(tlo, "chats", None)
+        changed = {
+            chan.id: chan.access_hash
+            for chan in entities or []
+            if isinstance(chan, TLChannel)
+            and not chan.min
+            and chan.access_hash
+            and chan.id in self._hashes
+            and self._hashes[chan.id] != chan.access_hash
+        }
+        if changed:
+            self._hashes.update(changed)
+            with self._lock:
+                self._changed_hashes.update(changed)
+
+    def flush(self) -> None:
+        """Write the buffered update state and access hashes in one transaction.
+
+        Blocking, call it outside of the event loop.
+        """
+        with self._lock:
+            states, self._states = self._states, {}
+            hashes, self._changed_hashes = self._changed_hashes, {}
+        if not states and not hashes:
+            return
+        try:
+            with session_scope() as session:
+                if 0 in states:
+                    self._save_common_state(session, states[0])
+                chan_ids = (states.keys() - {0}) | hashes.keys()
+                query = session.query(Channel).filter_by(session=self.index)
+                for chan in query.filter(Channel.id.in_(chan_ids)):
+                    if chan.id in states:
+                        chan.pts = states[chan.id].pts
+                    if chan.id in hashes:
+                        chan.access_hash = hashes[chan.id]
+        except Exception:
+            with self._lock:  # keep newer values, retry on the next flush
+                self._states = {**states, **self._states}
+                self._changed_hashes = {**hashes, **self._changed_hashes}
+            raise
+
+    def _save_common_state(self, session, state) -> None:
+        dbstate = session.query(UpdateState).filter_by(id=self.index).first()
+        if not dbstate:
+            dbstate = UpdateState(id=self.index)
+            session.add(dbstate)
+        dbstate.pts = state.pts
+        dbstate.qts = state.qts
+        dbstate.date = int(state.date.timestamp())
+        dbstate.seq = state.seq
+
+    def close(self) -> None:
+        self.flush()
+        super().close()
+
+    def add_channel(self, chan_id: int, access_hash: int) -> None:
+        """Start tracking a newly subscribed channel, already saved in the database."""
+        self._hashes[chan_id] = access_hash
+
+    def get_entity_rows_by_id(self, id: int, exact: bool = True):  # noqa
+        row = super().get_entity_rows_by_id(id, exact)
+        if row:
+            return row
+        if id < 0:
+            chan_id, kind = utils.resolve_id(id)
+            if kind is not PeerChannel:
+                return None
+        elif exact:  # a positive marked ID is an user
+            return None
+        else:
+            chan_id = id
+        access_hash = self._hashes.get(chan_id)
+        if access_hash:
+            return utils.get_peer_id(PeerChannel(chan_id)), access_hash
+        return None
@@ -1,19 +1,45 @@
 """Utilities"""
 
 import asyncio
-from functools import wraps
+from concurrent.futures import Future
+from functools import partial, wraps
+from threading import Lock, Thread
+from typing import Dict, List, Optional
 
 from simplebot import DeltaBot
 from telethon import TelegramClient
 from telethon.sessions import StringSession
 
+from .ratelimit import RateLimiter
+from .tgsession import DBSession
+
 _scope = __name__.split(".", maxsplit=1)[0]
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_lock = Lock()
+_clients: Dict[int, TelegramClient] = {}
+_client_lock: Optional[asyncio.Lock] = None
+_limiters: Dict[TelegramClient, RateLimiter] = {}
+
+
+def get_loop() -> asyncio.AbstractEventLoop:
+    """Get the event loop shared by all Telegram operations, starting it if needed."""
+    global _loop  # noqa
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            Thread(target=_loop.run_forever, daemon=True).start()
+    return _loop
+
+
+def submit(coro) -> Future:
+    """Schedule the given coroutine in the shared event loop."""
+    return asyncio.run_coroutine_threadsafe(coro, get_loop())
 
 
 def sync(func):
     @wraps(func)
     def wrapper(*args, **kwargs):
-        asyncio.new_event_loop().run_until_complete(func(*args, **kwargs))
+        return submit(func(*args, **kwargs)).result()
 
     return wrapper
 
@@ -30,13 +56,86 @@ def set_config(bot: DeltaBot, key: str, value: str = None) -> None:
     bot.set(key, value, scope=_scope)
 
 
-def get_client(bot: DeltaBot, session: str = None) -> TelegramClient:
+def get_sessions(bot: DeltaBot) -> List[str]:
+    """Get the list of logged in Telegram sessions."""
+    return (getdefault(bot, "session") or "").split()
+
+
+def set_session(bot: DeltaBot, index: int, session: str) -> None:
+    """Update the Telegram session at the given position of the session list."""
+    sessions = get_sessions(bot)
+    sessions[index] = session
+    set_config(bot, "session", " ".join(sessions))
+
+
+def add_session(bot: DeltaBot, session: str) -> int:
+    """Add a Telegram session to the session list and return its index."""
+    sessions = get_sessions(bot)
+    sessions.append(session)
+    set_config(bot, "session", " ".join(sessions))
+    return len(sessions) - 1
+
+
+def get_client(
+    bot: DeltaBot, session: str = None, session_class=StringSession, **kwargs
+) -> TelegramClient:
     api_id = getdefault(bot, "api_id")
     api_hash = getdefault(bot, "api_hash")
     if session is None:
-        session = getdefault(bot, "session")
+        session = get_sessions(bot)[0]
     return TelegramClient(
-        StringSession(session) if session else StringSession(),
+        session_class(session) if session else session_class(),
         api_id=api_id,
         api_hash=api_hash,
+        **kwargs,
     )
+
+
+async def get_connected_client(bot: DeltaBot, index: int = 0) -> TelegramClient:
+    """Get the long-lived client of the given session, (re)connecting it if needed.
+
+    Must be called from the shared event loop.
+    """
+    global _client_lock  # noqa
+    if _client_lock is None:
+        _client_lock = asyncio.Lock()
+    async with _client_lock:
+        client = _clients.get(index)
+        if client is None:
+            client = _clients[index] = get_client(
+                bot,
+                session=get_sessions(bot)[index],
+                session_class=partial(DBSession, index=index),
+                catch_up=getdefault(bot, "live") == "1",
+                flood_sleep_threshold=0,  # flood waits are handled by the rate limiter
+            )
+            _limiters[client] = RateLimiter(
+                float(getdefault(bot, "rate_limit")), logger=bot.logger
+            )
+        if not client.is_connected():
+            await client.connect()
+    return client
+
+
+def get_limiter(client: TelegramClient) -> RateLimiter:
+    """Get the rate limiter all requests sent with the given client must go through.
+
+    Each session has its own flood limits, so each client has its own limiter.
+    """
+    return _limiters[client]
+
+
+def add_client(index: int, client: TelegramClient, limiter: RateLimiter) -> None:
+    """Use the given connected client, and its rate limiter, for the session at ``index``."""
+    _clients[index] = client
+    _limiters[client] = limiter
+
+
+async def save_update_state(client: TelegramClient) -> None:
+    """Write the update state buffered by the client's session to the database.
+
+    Telethon hands the state to the session every minute and on disconnection,
+    the writes are done here in a worker thread so they don't block the event loop.
+    """
+    if isinstance(client.session, DBSession):
+        await asyncio.get_running_loop().run_in_executor(None, client.session.flush)
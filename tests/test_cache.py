@@ -0,0 +1,89 @@
+import asyncio
+import os
+
+from simplebot_tgchan.cache import _LRU, MediaCache, PageCache
+
+
+def test_lru() -> None:
+    lru = _LRU(max_size=10)
+    lru.put("a", 1, 4)
+    lru.put("b", 2, 4)
+    assert lru.get("a") == 1  # "b" is now the least recently used
+    lru.put("c", 3, 4)
+    assert lru.evict() == [("b", 2)]
+    assert ("b" in lru, lru.size) == (False, 8)
+    lru.put("a", 4, 1)  # replaced
+    assert (lru.pop("a"), lru.size) == (4, 4)
+
+
+def test_page_cache(tmp_path) -> None:
+    renders = []
+
+    async def render(file) -> None:
+        renders.append(1)
+        await asyncio.sleep(0)
+        file.write("x" * 10)
+
+    async def get_pages(cache: PageCache, *keys: str) -> list:
+        paths = [str(tmp_path / f"page{index}.html") for index in range(len(keys))]
+        for path in paths:
+            if os.path.exists(path):
+                os.remove(path)
+        await asyncio.gather(
+            *(cache.get(key, path, render) for key, path in zip(keys, paths))
+        )
+        pages = []
+        for path in paths:
+            with open(path, encoding="utf-8") as file:
+                pages.append(file.read())
+        return pages
+
+    cache = PageCache(str(tmp_path / "pages"), max_size=25)
+    # concurrent requests of the same page share the render
+    assert asyncio.run(get_pages(cache, "a", "a")) == ["x" * 10] * 2
+    assert len(renders) == 1
+
+    # the pages on disk survive restarts, the oldest are evicted
+    asyncio.run(get_pages(cache, "b", "c"))
+    cache = PageCache(str(tmp_path / "pages"), max_size=25)
+    assert asyncio.run(get_pages(cache, "b", "c")) == ["x" * 10] * 2
+    assert len(renders) == 3
+    asyncio.run(get_pages(cache, "a"))
+    assert len(renders) == 4
+
+
+def test_media_cache(tmp_path) -> None:
+    downloads = []
+
+    async def download(folder: str) -> str:
+        downloads.append(folder)
+        path = os.path.join(folder, "photo.jpg")
+        with open(path, "wb") as file:
+            file.write(b"x" * 10)
+        return path
+
+    async def get_files(cache: MediaCache, *keys: str) -> list:
+        return await asyncio.gather(
+            *(
+                cache.get(key, str(tmp_path / "spool" / str(index)), download)
+                for index, key in enumerate(keys)
+            )
+        )
+
+    for index in range(3):
+        os.makedirs(tmp_path / "spool" / str(index))
+    cache = MediaCache(str(tmp_path / "media"), max_size=15)
+    # concurrent requests of the same file share the download
+    paths = asyncio.run(get_files(cache, "a", "a"))
+    assert len(downloads) == 1
+    assert [os.path.dirname(path) for path in paths] == [
+        str(tmp_path / "spool" / "0"),
+        str(tmp_path / "spool" / "1"),
+    ]
+
+    # evicting a file doesn't remove the copies handed out
+    asyncio.run(get_files(cache, "b"))
+    assert len(downloads) == 2
+    assert os.path.exists(paths[0])
+    asyncio.run(get_files(cache, "x", "a"))
+    assert len(downloads) == 4
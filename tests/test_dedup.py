@@ -0,0 +1,47 @@
+from unittest.mock import patch
+
+from simplebot_tgchan.dedup import DedupIndex
+
+
+def test_cross_channel() -> None:
+    index = DedupIndex(60)
+    assert index.unseen([1, 2], ["hash:a"], 100) == [1, 2]
+    index.add([1], ["hash:a"], 100)
+    index.release([2], ["hash:a"])
+    # the same channel can post the same thing again
+    assert index.unseen([1, 2], ["hash:a"], 100) == [1, 2]
+    index.release([1, 2], ["hash:a"])
+    # but other channels can't send it to the chats that got it
+    assert index.unseen([1, 2], ["origin:5:1", "hash:a"], 200) == [2]
+
+
+def test_reservation() -> None:
+    index = DedupIndex(60)
+    # a copy checked in another channel before the post is queued is suppressed
+    assert index.unseen([1, 2], ["hash:a"], 100) == [1, 2]
+    assert index.unseen([1, 2], ["hash:a"], 200) == []
+    # until the post fails
+    index.release([1, 2], ["hash:a"])
+    assert index.unseen([1, 2], ["hash:a"], 200) == [1, 2]
+    index.add([1, 2], ["hash:a"], 200)
+    # confirmed posts are not released
+    index.release([1, 2], ["hash:a"])
+    assert index.unseen([1, 2], ["hash:a"], 100) == []
+
+
+def test_expiration() -> None:
+    index = DedupIndex(60, max_size=2)
+    with patch("time.time", return_value=0):
+        index.add([1], ["hash:a"], 100)
+        index.add([2], ["hash:a"], 100)
+        index.add([3], ["hash:a"], 100)
+        # the oldest entry is dropped to make room
+        assert index.unseen([1, 2, 3], ["hash:a"], 200) == [1]
+    with patch("time.time", return_value=60):
+        assert index.unseen([1, 2, 3], ["hash:a"], 200) == [1, 2, 3]
+
+
+def test_disabled() -> None:
+    index = DedupIndex(0)
+    index.add([1], ["hash:a"], 100)
+    assert index.unseen([1], ["hash:a"], 200) == [1]
@@ -0,0 +1,69 @@
+import asyncio
+import logging
+import os
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from simplebot_tgchan import outbox
+from simplebot_tgchan.digest import add_post, flush_digests, parse_duration, save_images
+from simplebot_tgchan.instantview import ImageOptions
+from simplebot_tgchan.orm import (
+    Channel,
+    DigestPost,
+    Outbox,
+    Subscription,
+    init,
+    session_scope,
+)
+
+
+def test_parse_duration() -> None:
+    assert parse_duration("90") == 90
+    assert parse_duration("30m") == 30 * 60
+    assert parse_duration(" 1H ") == 60 * 60
+    assert parse_duration("2d") == 2 * 60 * 60 * 24
+    for text in ("", "0", "1w", "h", "-1h"):
+        with pytest.raises(ValueError):
+            parse_duration(text)
+
+
+def test_flush_digests(tmp_path) -> None:
+    init(f"sqlite:///{tmp_path / 'sqlite.db'}")
+    bot = SimpleNamespace(logger=logging.getLogger())
+    outbox.start_delivery(bot, str(tmp_path / "outbox"), workers=0)
+    with session_scope() as session:
+        session.add(Channel(id=1, title="News", last_msg=0))
+        session.add(Subscription(chat_id=10, chan_id=1, filter="", digest=3600))
+        session.add(Subscription(chat_id=11, chan_id=1, filter="", digest=3600))
+    image = tmp_path / "image.png"
+    image.write_bytes(b"not really an image")
+    spool = save_images([str(image)])
+    image.unlink()  # the post keeps its own copy
+    with session_scope() as session:
+        add_post(session, 1, [10], "<p>first</p>", spool)
+        add_post(session, 1, [10, 11], "<p>second</p>")
+
+    def flush() -> bool:
+        return asyncio.run(flush_digests(ImageOptions()))
+
+    assert flush()
+    with session_scope() as session:
+        rows = {row.chat_id: row for row in session.query(Outbox)}
+        assert rows[10].text == "📰 2 new posts from 'News'"
+        with open(rows[10].html, encoding="utf-8") as file:
+            html = file.read()
+        assert html.index("first") < html.index("second")
+        # the images are only inlined in the digest
+        assert html.index("data:image/png;base64,") < html.index("first")
+        assert rows[11].text == "📰 1 new posts from 'News'"
+        assert not session.query(DigestPost).count()
+        for subs in session.query(Subscription):
+            assert subs.digest_at > time.time() + 3000
+    assert not os.path.exists(spool)
+
+    # the next digest isn't due yet
+    with session_scope() as session:
+        add_post(session, 1, [10], "<p>third</p>")
+    assert not flush()
@@ -0,0 +1,27 @@
+import pytest
+
+from simplebot_tgchan import filters
+from simplebot_tgchan.filters import Matcher
+
+
+@pytest.mark.parametrize("automaton_min", [1, 1000])
+def test_matcher(monkeypatch, automaton_min: int) -> None:
+    # the same matches with the automaton and with plain searches
+    monkeypatch.setattr(filters, "_AUTOMATON_MIN_KEYWORDS", automaton_min)
+    matcher = Matcher(
+        [
+            (1, ""),
+            (2, "cat"),
+            (3, "i:CAT"),
+            (4, "w:cat"),
+            (5, "iw:cat"),
+            (6, "re:d[o0]g"),
+            (7, "re:("),
+            (8, "iw:STRASSE"),
+        ]
+    )
+    assert matcher.match("Catalog") == [1, 3]
+    assert matcher.match("a cat!") == [1, 2, 3, 4, 5]
+    assert matcher.match("The CAT") == [1, 3, 5]
+    assert matcher.match("d0g") == [1, 6]
+    assert matcher.match("İ Straße!") == [1, 8]
@@ -0,0 +1,60 @@
+import asyncio
+import base64
+import io
+from types import SimpleNamespace
+
+from PIL import Image
+from telethon.tl import types
+
+from simplebot_tgchan.instantview import (
+    ImageOptions,
+    RenderContext,
+    encode_image,
+    is_supported_format,
+    page2html,
+)
+
+
+class FakeClient:
+    async def download_media(self, media, file) -> bytes:  # noqa
+        output = io.BytesIO()
+        Image.new("RGB", (100, 100), "red").save(output, format="JPEG")
+        return output.getvalue()
+
+
+def test_caption_without_image() -> None:
+    caption = types.PageCaption(types.TextPlain("the caption"), types.TextEmpty())
+    page = SimpleNamespace(
+        blocks=[types.PageBlockPhoto(photo_id=1, caption=caption)],
+        photos=[SimpleNamespace(id=1)],
+        documents=[],
+    )
+    msg = SimpleNamespace(
+        media=None, web_preview=SimpleNamespace(photo=None, cached_page=page)
+    )
+    html = asyncio.run(
+        page2html(
+            page.blocks,
+            RenderContext(
+                client=FakeClient(), msg=msg, img_options=ImageOptions(page_budget=1)
+            ),
+        )
+    )
+    assert "<img" not in html
+    assert "the caption" in html
+
+
+def test_encode_image_fallback() -> None:
+    data = asyncio.run(FakeClient().download_media(None, bytes))
+    # images that can't be transcoded are embedded as they are
+    for img, options in (
+        (data, ImageOptions(img_format="NOPE")),
+        (data[:20], ImageOptions()),
+    ):
+        _, encoded = asyncio.run(encode_image(img, options))
+        assert base64.b64decode(encoded) == img
+
+
+def test_supported_format() -> None:
+    assert is_supported_format("jpeg")
+    assert not is_supported_format("NOPE")
@@ -0,0 +1,28 @@
+from simplebot_tgchan import metrics
+
+
+def test_metrics(tmp_path) -> None:
+    metrics.inc("messages_fetched", 3)
+    metrics.inc("messages_fetched")
+    metrics.observe("test_seconds", 0.02)
+    metrics.observe("test_seconds", 2)
+    metrics.observe_channel(1, 0.5)
+    metrics.observe_channel(2, 3)
+    metrics.observe_channel(1, 0.1)
+    assert metrics.get_slowest_channels(1) == [(2, 3)]
+    metrics.forget_channel(2)
+    assert metrics.get_slowest_channels() == [(1, 0.1)]
+
+    report = metrics.get_report({"outbox_size": 7})
+    assert "Messages fetched from Telegram: 4" in report
+    assert "Messages waiting to be sent to Delta Chat: 7" in report
+
+    path = tmp_path / "tgchan.prom"
+    metrics.dump(str(path), {"outbox_size": 7})
+    lines = path.read_text().splitlines()
+    assert "# TYPE tgchan_messages_fetched counter" in lines
+    assert "tgchan_messages_fetched 4" in lines
+    assert "tgchan_outbox_size 7" in lines
+    assert 'tgchan_test_seconds_bucket{le="0.05"} 1' in lines
+    assert 'tgchan_test_seconds_bucket{le="+Inf"} 2' in lines
+    assert "tgchan_test_seconds_count 2" in lines
@@ -0,0 +1,34 @@
+import sqlite3
+
+from simplebot_tgchan.orm import Channel, Subscription, init, session_scope
+
+
+def test_migrate(tmp_path) -> None:
+    path = tmp_path / "sqlite.db"
+    with sqlite3.connect(path) as conn:
+        # the tables as created by the first version of the plugin
+        conn.execute(
+            "CREATE TABLE channel"
+            " (id INTEGER PRIMARY KEY, title VARCHAR(1000), last_msg INTEGER)"
+        )
+        conn.execute(
+            "CREATE TABLE subscription (chat_id INTEGER, chan_id INTEGER,"
+            " filter VARCHAR(1000), PRIMARY KEY (chat_id, chan_id))"
+        )
+        conn.execute("INSERT INTO channel VALUES (1, 'title', 10)")
+        conn.execute("INSERT INTO subscription VALUES (100, 1, '')")
+    init(f"sqlite:///{path}")
+    with session_scope() as session:
+        channel = session.query(Channel).one()
+        assert (channel.title, channel.last_msg) == ("title", 10)
+        # new columns get their default in existing rows
+        assert (channel.session, channel.failures) == (0, 0)
+        assert channel.last_post is channel.retry_at is None
+        channel.post_interval = 60.0
+        session.query(Subscription).one().digest = 3600
+    with session_scope() as session:
+        assert session.query(Channel).one().post_interval == 60.0
+        assert session.query(Subscription).one().digest == 3600
+    with sqlite3.connect(path) as conn:
+        indexes = conn.execute("PRAGMA index_list(subscription)").fetchall()
+        assert "ix_subscription_chan_id" in [index[1] for index in indexes]
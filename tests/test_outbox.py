@@ -0,0 +1,106 @@
+import logging
+import os
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from simplebot_tgchan import outbox
+from simplebot_tgchan.orm import Outbox, init, session_scope
+
+
+class FakeReplies:
+    """Records the sent messages, fails sending the texts in ``failing``."""
+
+    sent: list = []
+    failing: set = set()
+
+    def __init__(self, bot, logger) -> None:  # noqa
+        self.queue: list = []
+
+    def add(self, **kwargs) -> None:
+        self.queue.append(kwargs)
+
+    def send_reply_messages(self) -> list:
+        msgs = []
+        for args in self.queue:
+            if args.get("text") in self.failing:
+                raise ValueError("can't send")
+            self.sent.append((args["chat"], args.get("text"), args.get("filename")))
+            # Delta Chat copies attachments to its blob directory
+            blob = (
+                args.get("filename") and f"/blobs/{os.path.basename(args['filename'])}"
+            )
+            msgs.append(SimpleNamespace(filename=blob))
+        return msgs
+
+
+@pytest.fixture
+def bot(tmp_path, monkeypatch):
+    init(f"sqlite:///{tmp_path / 'sqlite.db'}")
+    bot = SimpleNamespace(logger=logging.getLogger(), get_chat=lambda chat_id: chat_id)
+    outbox.start_delivery(bot, str(tmp_path / "outbox"), workers=0)
+    monkeypatch.setattr(outbox, "Replies", FakeReplies)
+    monkeypatch.setattr(FakeReplies, "sent", [])
+    monkeypatch.setattr(FakeReplies, "failing", set())
+    return bot
+
+
+def queue(chats: list, **args) -> None:
+    with session_scope() as session:
+        outbox.enqueue(session, chats, args)
+
+
+def test_order(bot) -> None:
+    queue([1], text="a")
+    queue([2], text="b")
+    queue([1], text="c")
+    assert outbox.deliver(bot) == 3
+    assert [(chat, text) for chat, text, _ in FakeReplies.sent] == [
+        (1, "a"),
+        (1, "c"),
+        (2, "b"),
+    ]
+    assert outbox.deliver(bot) == 0
+
+
+def test_retry(bot) -> None:
+    FakeReplies.failing.add("a")
+    queue([1], text="a")
+    queue([1], text="b")
+    queue([2], text="c")
+    # the failed message holds back the next messages of its chat only
+    assert outbox.deliver(bot) == 1
+    assert [text for _, text, _ in FakeReplies.sent] == ["c"]
+    with session_scope() as session:
+        row = session.query(Outbox).filter_by(text="a").one()
+        assert row.attempts == 1
+        assert row.retry_at > time.time()
+    assert outbox.deliver(bot) == 0
+
+    # the message is dropped after too many attempts
+    with session_scope() as session:
+        row = session.query(Outbox).filter_by(text="a").one()
+        row.attempts = outbox._MAX_ATTEMPTS - 1
+        row.retry_at = 0
+    assert outbox.deliver(bot) == 1
+    assert outbox.deliver(bot) == 1
+    assert [text for _, text, _ in FakeReplies.sent] == ["c", "b"]
+    with session_scope() as session:
+        assert not session.query(Outbox).count()
+
+
+def test_spool(bot) -> None:
+    spool = outbox.make_spool_dir()
+    path = os.path.join(spool, "photo.jpg")
+    with open(path, "wb") as file:
+        file.write(b"data")
+    queue([1, 2], text="a", filename=path, spool=spool)
+    assert outbox.deliver(bot) == 2
+    # the file sent to the first chat is reused for the other
+    assert [filename for *_, filename in FakeReplies.sent] == [
+        path,
+        "/blobs/photo.jpg",
+    ]
+    # the files are removed once all the chats got the message
+    assert not os.path.exists(spool)
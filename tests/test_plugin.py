@@ -1,3 +1,28 @@
+import asyncio
+import logging
+import time
+from types import SimpleNamespace
+
+from telethon.errors import ChannelPrivateError
+from telethon.tl.functions.channels import JoinChannelRequest
+
+import simplebot_tgchan as plugin
+from simplebot_tgchan import _cut_last_album, _group_albums, outbox
+from simplebot_tgchan.channels import join_channel
+from simplebot_tgchan.dedup import DedupIndex
+from simplebot_tgchan.digest import add_post
+from simplebot_tgchan.orm import (
+    Channel,
+    DigestPost,
+    Outbox,
+    Subscription,
+    init,
+    session_scope,
+)
+from simplebot_tgchan.ratelimit import RateLimiter
+from simplebot_tgchan.util import add_client
+
+
 class TestPlugin:
     """Offline tests"""
 
@@ -8,3 +33,193 @@ class TestPlugin:
     def test_unsub(self, mocker) -> None:
         msg = mocker.get_one_reply("/unsub")
         assert "❌" in msg.text
+
+
+def test_albums() -> None:
+    messages = [
+        SimpleNamespace(id=1, grouped_id=None),
+        SimpleNamespace(id=2, grouped_id=10),
+        SimpleNamespace(id=3, grouped_id=10),
+        SimpleNamespace(id=4, grouped_id=None),
+        SimpleNamespace(id=5, grouped_id=20),
+        SimpleNamespace(id=6, grouped_id=20),
+    ]
+    posts = _group_albums(messages)
+    assert [[msg.id for msg in post] for post in posts] == [[1], [2, 3], [4], [5, 6]]
+
+    assert [msg.id for msg in _cut_last_album(messages)] == [1, 2, 3, 4]
+    assert _cut_last_album(messages[:4]) == messages[:4]
+    # a batch with a single album is kept whole
+    assert _cut_last_album(messages[4:]) == messages[4:]
+
+
+class FakeBot:
+    def __init__(self) -> None:
+        self.logger = logging.getLogger()
+        self.config: dict = {}
+
+    def get(self, key: str, default=None, scope: str = "") -> str:
+        return self.config.get(f"{scope}/{key}", default)
+
+    def set(self, key: str, value: str, scope: str = "") -> None:
+        self.config[f"{scope}/{key}"] = value
+
+
+def test_quarantine(tmp_path) -> None:
+    bot = FakeBot()
+    settings = dict(delay=300, max_delay=3600, max_failures=3, probe_delay=86400)
+    for key, value in settings.items():
+        bot.set(key, str(value), scope="simplebot_tgchan")
+    init(f"sqlite:///{tmp_path / 'sqlite.db'}")
+    outbox.start_delivery(bot, str(tmp_path / "outbox"), workers=0)
+    with session_scope() as session:
+        session.add(Channel(id=1, title="News", last_msg=0))
+        session.add(Subscription(chat_id=10, chan_id=1, filter=""))
+    with session_scope() as session:
+        plugin._routes.load(plugin.get_subscriptions(session))
+
+    def get_state() -> tuple:
+        with session_scope() as session:
+            channel = session.query(Channel).one()
+            delay = channel.retry_at and round(channel.retry_at - time.time())
+            notices = [row.text for row in session.query(Outbox)]
+            return channel.failures, delay, notices
+
+    # failing channels are checked less and less often
+    plugin._on_check_failure(bot, 1, ChannelPrivateError(None))
+    assert get_state() == (1, 300, [])
+    plugin._on_check_failure(bot, 1, ChannelPrivateError(None))
+    assert get_state() == (2, 600, [])
+    # then quarantined, subscribers are told once
+    plugin._on_check_failure(bot, 1, ChannelPrivateError(None))
+    plugin._on_check_failure(bot, 1, ChannelPrivateError(None))
+    failures, delay, notices = get_state()
+    assert (failures, delay) == (4, 60 * 60 * 24)
+    assert len(notices) == 1 and notices[0].startswith("⚠️")
+
+    plugin._on_check_success(bot, 1)
+    failures, delay, notices = get_state()
+    assert (failures, delay) == (0, None)
+    assert len(notices) == 2 and notices[1].startswith("✔️")
+
+
+class FakeClient:
+    def __init__(self, index: int) -> None:
+        self.session = SimpleNamespace(index=index)
+        self.requests: list = []
+
+    async def __call__(self, request):
+        self.requests.append(request)
+        return SimpleNamespace(chats=[request.channel])
+
+    async def get_entity(self, username: str):
+        chan_id = {"owned": 1, "new": 2}[username]
+        return SimpleNamespace(id=chan_id, broadcast=True, left=True)
+
+
+def test_join_channel(tmp_path) -> None:
+    init(f"sqlite:///{tmp_path / 'sqlite.db'}")
+    with session_scope() as session:
+        session.add(Channel(id=1, title="Owned", last_msg=0, session=1))
+    client = FakeClient(index=0)
+    add_client(0, client, RateLimiter(1000))
+
+    # channels handled by another session are not joined
+    channel, owner = asyncio.run(join_channel(client, "owned", False))
+    assert (channel.id, owner, client.requests) == (1, 1, [])
+
+    channel, owner = asyncio.run(join_channel(client, "new", False))
+    assert (channel.id, owner) == (2, None)
+    assert [type(request) for request in client.requests] == [JoinChannelRequest]
+
+
+def test_advance_last_msg(tmp_path) -> None:
+    init(f"sqlite:///{tmp_path / 'sqlite.db'}")
+    with session_scope() as session:
+        session.add(Channel(id=1, title="News", last_msg=10))
+    with session_scope() as session:
+        plugin._advance_last_msg(session, 1, 20)
+        plugin._advance_last_msg(session, 1, 15)  # never goes backwards
+    with session_scope() as session:
+        assert session.query(Channel.last_msg).scalar() == 20
+
+
+def test_failed_post_is_retried(tmp_path, monkeypatch) -> None:
+    bot = FakeBot()
+    init(f"sqlite:///{tmp_path / 'sqlite.db'}")
+    with session_scope() as session:
+        session.add(Channel(id=1, title="News", last_msg=0))
+
+    async def tg2dc(*args) -> None:
+        raise ValueError("boom")
+
+    monkeypatch.setattr(plugin, "tg2dc", tg2dc)
+    monkeypatch.setattr(plugin, "_dedup", DedupIndex(60))
+    channel = SimpleNamespace(id=1, title="News")
+    post = [SimpleNamespace(id=5, grouped_id=None, date=None)]
+
+    def process() -> bool:
+        return asyncio.run(
+            plugin.process_messages(bot, None, channel, post, plugin._routes.get(1))
+        )
+
+    def get_last_msg() -> int:
+        with session_scope() as session:
+            return session.query(Channel.last_msg).scalar()
+
+    # the progress is kept so the post is tried again in the next check
+    assert not process()
+    assert not process()
+    assert get_last_msg() == 0
+    # until it is skipped after too many attempts
+    assert process()
+    assert get_last_msg() == 5
+
+
+def test_resubscribe(tmp_path, monkeypatch) -> None:
+    bot = FakeBot()
+    bot.set("session", "session0", scope="simplebot_tgchan")
+    bot.is_admin = lambda contact: False
+    init(f"sqlite:///{tmp_path / 'sqlite.db'}")
+    outbox.start_delivery(bot, str(tmp_path / "outbox"), workers=0)
+    with session_scope() as session:
+        session.add(Channel(id=1, title="News", last_msg=0))
+    channel = SimpleNamespace(id=1, title="News", broadcast=True)
+    client = SimpleNamespace(session=SimpleNamespace(save=lambda: "session0"))
+
+    async def get_connected_client(bot, index: int):
+        return client
+
+    async def fake_join_channel(client, chan: str, invite: bool, max_wait) -> tuple:
+        return channel, 0
+
+    monkeypatch.setattr(plugin, "get_connected_client", get_connected_client)
+    monkeypatch.setattr(plugin, "join_channel", fake_join_channel)
+    message = SimpleNamespace(chat=SimpleNamespace(id=10))
+    message.get_sender_contact = lambda: None
+
+    def sub(payload: str) -> str:
+        replies: list = []
+        replies_ = SimpleNamespace(add=lambda **kwargs: replies.append(kwargs))
+        asyncio.run(plugin._sub.__wrapped__(bot, payload, message, replies_))
+        return replies[0]["text"]
+
+    def get_subscription() -> tuple:
+        with session_scope() as session:
+            subs = session.query(Subscription).one()
+            return subs.filter, subs.digest, subs.digest_at is not None
+
+    assert sub("news") == "✔️ Subscribed to 'News'"
+    assert get_subscription() == ("", None, False)
+    # subscribing again updates the subscription
+    assert sub("news --digest 1h cats") == "✔️ Subscribed to 'News'"
+    assert get_subscription() == ("cats", 60 * 60, True)
+    assert plugin._routes.get_digests(1) == {10: 60 * 60}
+    # the pending posts are dropped when digests are turned off
+    with session_scope() as session:
+        add_post(session, 1, [10], "<p>post</p>")
+    assert sub("news") == "✔️ Subscribed to 'News'"
+    assert get_subscription() == ("", None, False)
+    assert not plugin._routes.get_digests(1)
+    with session_scope() as session:
+        assert not session.query(DigestPost).count()
@@ -0,0 +1,46 @@
+import asyncio
+import time
+
+import pytest
+from telethon.errors import FloodWaitError
+
+from simplebot_tgchan.ratelimit import RateLimiter
+
+
+def test_flood_wait() -> None:
+    calls = []
+
+    async def request() -> str:
+        calls.append(time.monotonic())
+        if len(calls) == 1:
+            raise FloodWaitError(None, capture=1)
+        return "ok"
+
+    limiter = RateLimiter(10)
+    assert asyncio.run(limiter.call("history", request)) == "ok"
+    # the request is retried once the wait is over
+    assert len(calls) == 2
+    assert calls[1] - calls[0] >= 1
+    # and the requests of its class are slowed down
+    assert limiter._buckets["history"].rate < 10
+
+
+def test_max_wait() -> None:
+    calls = []
+
+    async def request() -> None:
+        calls.append(time.monotonic())
+        raise FloodWaitError(None, capture=60)
+
+    async def main() -> None:
+        limiter = RateLimiter(10)
+        # interactive requests give up instead of waiting too long
+        with pytest.raises(FloodWaitError):
+            await limiter.call("join", request, max_wait=5)
+        assert len(calls) == 1
+        # and don't send more requests while the class is paused
+        with pytest.raises(FloodWaitError):
+            await limiter.call("join", request, max_wait=5)
+        assert len(calls) == 1
+
+    asyncio.run(main())
@@ -0,0 +1,23 @@
+from simplebot_tgchan.routing import RoutingTable
+
+
+def test_routing() -> None:
+    routes = RoutingTable()
+    routes.load({1: [(10, "", None), (11, "cat", 3600)]})
+    assert routes.get(1).match("a dog") == [10]
+    assert routes.get(1).match("a cat") == [10, 11]
+    assert routes.get(2).match("a dog") == []
+    assert routes.get_digests(1) == {11: 3600}
+
+    routes.add(1, 11, "dog")  # the subscription of a chat is replaced
+    routes.add(2, 10, "", 60)
+    assert routes.get(1).match("a dog") == [10, 11]
+    assert routes.get_digests(1) == {}
+    assert routes.get(2).match("a dog") == [10]
+    assert routes.get_digests(2) == {10: 60}
+
+    routes.remove(1, 10)
+    routes.remove(2, 10)
+    assert routes.get(1).chats == [11]
+    assert not routes.get(2)
+    assert routes.get_digests(2) == {}
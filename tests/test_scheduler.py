@@ -0,0 +1,52 @@
+from simplebot_tgchan.scheduler import (
+    Delays,
+    Scheduler,
+    next_interval,
+    retry_delay,
+    update_activity,
+)
+
+
+def test_scheduler() -> None:
+    scheduler = Scheduler()
+    scheduler.sync({1: 10, 2: 20})
+    scheduler.schedule(2, 5)  # rescheduled, the old entry is ignored
+    assert scheduler.next_due() == 5
+    assert scheduler.pop_due(10) == [2, 1]
+    assert scheduler.pop_due(30) == []
+    assert scheduler.next_due() is None
+
+    scheduler.sync({1: 10, 3: 30})
+    assert len(scheduler) == 2
+    scheduler.sync({3: 100})  # removed channels are forgotten
+    assert len(scheduler) == 1
+    assert scheduler.pop_due(40) == [3]
+
+
+def test_update_activity() -> None:
+    assert update_activity(None, None, 100) == (100, None)
+    assert update_activity(100, None, 160) == (160, 60)
+    assert update_activity(160, 60, 60) == (160, 60)
+    assert update_activity(160, 60, 260) == (260, 60 * 0.7 + 100 * 0.3)
+
+
+def test_next_interval() -> None:
+    delays = Delays(default=300, min_delay=60, max_delay=3600)
+    # unknown activity
+    assert next_interval(None, None, 1000, delays) == 300
+    # twice per interval between posts
+    assert next_interval(900, 400, 1000, delays) == 200
+    # silent channels are checked less often, within the limits
+    assert next_interval(0, 400, 1000, delays) == 500
+    assert next_interval(0, 400, 100000, delays) == 3600
+    assert next_interval(990, 10, 1000, delays) == 60
+
+
+def test_retry_delay() -> None:
+    assert [retry_delay(failures, 300, 3600) for failures in range(1, 6)] == [
+        300,
+        600,
+        1200,
+        2400,
+        3600,
+    ]
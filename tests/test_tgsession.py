@@ -0,0 +1,35 @@
+from datetime import datetime, timezone
+
+from telethon.tl.types import Channel as TLChannel
+from telethon.tl.types.updates import State
+
+from simplebot_tgchan.orm import Channel, UpdateState, init, session_scope
+from simplebot_tgchan.tgsession import DBSession
+
+
+def test_flush(tmp_path) -> None:
+    init(f"sqlite:///{tmp_path / 'sqlite.db'}")
+    with session_scope() as session:
+        session.add(Channel(id=1, title="News", last_msg=0, access_hash=10))
+    dbsession = DBSession()
+    date = datetime.fromtimestamp(1000, tz=timezone.utc)
+    dbsession.set_update_state(0, State(5, 6, date, 7, 0))
+    dbsession.set_update_state(1, State(50, 0, date, 0, 0))
+    dbsession.set_update_state(2, State(60, 0, date, 0, 0))  # not subscribed
+    dbsession.process_entities(
+        [TLChannel(1, "News", None, date, access_hash=20, min=False)]
+    )
+
+    # buffered until flushed
+    with session_scope() as session:
+        assert session.query(UpdateState).count() == 0
+        assert session.query(Channel.pts, Channel.access_hash).one() == (None, 10)
+    assert dbsession.get_update_state(1).pts == 50
+    assert [chan_id for chan_id, _ in dbsession.get_update_states()] == [0, 1]
+
+    dbsession.flush()
+    with session_scope() as session:
+        state = session.query(UpdateState).one()
+        assert (state.pts, state.qts, state.date, state.seq) == (5, 6, 1000, 7)
+        assert session.query(Channel.pts, Channel.access_hash).one() == (50, 20)
+    assert DBSession().get_update_state(1).pts == 50